@@ -1,83 +1,740 @@
+import gc
 import os
+import sys
 import json
-import requests
-from tornado.ioloop import IOLoop
-from tornado.wsgi import WSGIContainer
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.locks import Semaphore
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.httpclient import HTTPError as HTTPClientError
 from tornado.httpserver import HTTPServer
-from flask import Flask, jsonify, make_response
-from flask.ext.restful import Api, Resource, reqparse
-from petrarch import petrarch, PETRglobals, PETRreader, utilities
+from tornado.log import app_log
+from tornado.netutil import bind_sockets
+from tornado.options import define, options, parse_command_line
+from tornado.process import fork_processes, task_id, Subprocess
+from tornado.web import (Application, RequestHandler, HTTPError,
+                         stream_request_body)
+from petrarch import petrarch, PETRglobals, PETRreader, PETRcache, utilities
+from petrarch import PETRmetrics
 
-app = Flask(__name__)
-api = Api(app)
 cwd = os.path.abspath(os.path.dirname(__file__))
 
+define('port', default=5002, type=int, help='port to listen on')
+define('processes', default=1, type=int,
+       help='number of coding processes to fork; 0 starts one per CPU')
+define('parse_cache', default='',
+       help='SQLite file for the persistent parse cache; memory only if empty')
+define('parse_cache_size', default=10000, type=int,
+       help='number of parsed texts kept in memory')
+define('parse_cache_timeout', default=1, type=float,
+       help='seconds to wait for a lock on the parse cache file before a miss')
+define('parser_version', default='ccnlp-1.0.0',
+       help='tag stored with cached parses; change it when the parser changes')
+define('batch_window', default=5, type=float,
+       help='milliseconds texts wait to be parsed together with other requests')
+define('batch_size', default=32, type=int,
+       help='most texts sent to the parser in one call')
+define('max_active', default=32, type=int,
+       help='requests parsed or coded at the same time by each process')
+define('max_queued', default=128, type=int,
+       help='requests waiting for a slot before new ones are turned away')
+define('max_streams', default=2, type=int,
+       help='streamed uploads coded at the same time by each process')
+define('deadline', default=300, type=float,
+       help='seconds a request may take before it is abandoned with a 503')
+define('retry_after', default=5, type=int,
+       help='seconds clients are asked to wait after a 503')
+define('watch_dictionaries', default=0, type=float,
+       help='seconds between checks for edited dictionary files; 0 disables')
 
-@app.errorhandler(400)
-def bad_request(error):
-    return make_response(jsonify({'error': 'Bad request'}), 400)
+CCNLP_URL = 'http://ccnlp:5000/process'
+# long stories can keep the parser busy for a while
+CCNLP_TIMEOUT = 300
+# a streamed upload can carry a whole day's feed; it is never held in memory
+STREAM_MAX_BODY_SIZE = 64 * 1024 ** 3
 
+# petrarch keeps its coding state in module globals, so do_coding runs on a
+# single worker thread: the IOLoop stays free to accept requests and wait on
+# the parser while a story is being coded
+coding_executor = ThreadPoolExecutor(max_workers=1)
+# the parse cache file is shared by the processes, and a lookup may wait on
+# another one's lock: it is only used from this thread, never the IOLoop's
+cache_executor = ThreadPoolExecutor(max_workers=1)
 
-@app.errorhandler(404)
-def not_found(error):
-    return make_response(jsonify({'error': 'Not found'}), 404)
+# opened in make_app() so that every forked process gets its own connection
+parse_cache = None
+admission = None
+stream_admission = None
+batcher = None
+reloader = None
 
+request_seconds = PETRmetrics.Histogram('hypnos_request_seconds',
+                                        'Total time to answer a request.',
+                                        'handler')
 
-class ExtractAPI(Resource):
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('text', type=unicode, location='json')
-        self.reqparse.add_argument('id', type=unicode, location='json')
-        self.reqparse.add_argument('date', type=unicode, location='json')
-        super(ExtractAPI, self).__init__()
 
+class Admission(object):
+    """
+    Lets at most max_active requests run at once and at most max_queued wait for
+    a slot. Requests that find the queue full are turned away at once, so under a
+    burst clients get a quick 503 instead of waiting on an ever longer queue.
+    """
+    def __init__(self, max_active, max_queued):
+        self.slots = Semaphore(max_active)
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.active = 0
+        self.queued = 0
+
+    @gen.coroutine
+    def acquire(self, deadline):
+        if self.active >= self.max_active and self.queued >= self.max_queued:
+            raise HTTPError(503, reason='Queue full')
+        self.queued += 1
+        try:
+            yield self.slots.acquire(deadline)
+        except gen.TimeoutError:
+            raise HTTPError(503, reason='Deadline exceeded')
+        finally:
+            self.queued -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.slots.release()
+
+
+def time_left(deadline):
+    """ Returns the seconds left until deadline; raises a 503 once it has passed. """
+    left = deadline - IOLoop.current().time()
+    if left <= 0:
+        raise HTTPError(503, reason='Deadline exceeded')
+    return left
+
+
+class BaseHandler(RequestHandler):
+    def write_error(self, status_code, **kwargs):
+        errors = {400: 'Bad request', 404: 'Not found'}
+        if status_code == 503:
+            self.set_header('Retry-After', options.retry_after)
+        self.finish({'error': errors.get(status_code, self._reason)})
+
+    def on_finish(self):
+        request_seconds.observe(self.request.request_time(),
+                                self.__class__.__name__)
+
+    def get_json_body(self):
+        try:
+            return json.loads(self.request.body)
+        except ValueError:
+            raise HTTPError(400)
+
+
+class NotFoundHandler(BaseHandler):
+    def prepare(self):
+        raise HTTPError(404)
+
+
+class MetricsHandler(BaseHandler):
+    """
+    Serves the stage timings and coding counters in the Prometheus text format.
+    They are kept per process.
+    """
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(PETRmetrics.expose())
+
+
+class AdmittedHandler(BaseHandler):
+    """
+    Base for the request/response endpoints: the request waits for a slot from
+    admission and gets a deadline, options.deadline or the X-Request-Timeout
+    header if that is shorter, after which parsing and coding are abandoned.
+    """
+    admitted = False
+
+    @gen.coroutine
+    def prepare(self):
+        timeout = options.deadline
+        try:
+            timeout = min(timeout, float(
+                self.request.headers.get('X-Request-Timeout', timeout)))
+        except ValueError:
+            raise HTTPError(400)
+        self.deadline = IOLoop.current().time() + timeout
+        yield admission.acquire(self.deadline)
+        self.admitted = True
+
+    def on_finish(self):
+        BaseHandler.on_finish(self)
+        if self.admitted:
+            admission.release()
+            self.admitted = False
+
+
+def check_date(date):
+    """ Raises a 400 unless date is a valid YYYYMMDD string. """
+    if not (isinstance(date, basestring) and len(date) == 8 and date.isdigit()):
+        raise HTTPError(400)
+    try:
+        datetime.strptime(date, '%Y%m%d')
+    except ValueError:
+        raise HTTPError(400)
+
+
+def check_document(doc):
+    """ Raises a 400 unless doc is a dict with text, id and date. """
+    if not isinstance(doc, dict) or not all(doc.get(field) for field
+                                            in ('text', 'id', 'date')):
+        raise HTTPError(400)
+    if not isinstance(doc['text'], basestring):
+        raise HTTPError(400)
+    check_date(doc['date'])
+
+
+def check_unique_ids(docs):
+    """ Raises a 400 if two of docs have the same id: their results would collide. """
+    ids = set()
+    for doc in docs:
+        if doc['id'] in ids:
+            raise HTTPError(400)
+        ids.add(doc['id'])
+
+
+class ExtractHandler(AdmittedHandler):
+    @gen.coroutine
     def get(self):
-        args = self.reqparse.parse_args()
+        args = self.get_json_body()
+        check_document(args)
         text = args['text']
         text = text.encode('utf-8')
         storyid = args['id']
         date = args['date']
 
-        out = send_to_ccnlp(text)
-        event_dict = process_corenlp(out, date, storyid)
-        event_updated = petrarch.do_coding(event_dict, None)
+        out = yield parse_texts([text], self.deadline)
+        event_dict = process_corenlp(out[0], date, storyid)
+        event_updated = yield code_events(event_dict, self.deadline)
+
+        self.write(event_updated)
+
+
+class BatchExtractHandler(AdmittedHandler):
+    """
+    Codes a list of {text, id, date} documents in a single request. The texts
+    go to CoreNLP together and the combined event_dict through a single
+    do_coding() pass; the result is keyed by story id.
+    """
+    @gen.coroutine
+    def get(self):
+        docs = self.get_json_body()
+        if not isinstance(docs, list):
+            raise HTTPError(400)
+        for doc in docs:
+            check_document(doc)
+        check_unique_ids(docs)
+
+        texts = [doc['text'].encode('utf-8') for doc in docs]
+        outputs = yield parse_texts(texts, self.deadline)
+        event_dict = {}
+        for doc, out in zip(docs, outputs):
+            event_dict.update(process_corenlp(out, doc['date'], doc['id']))
+        event_updated = yield code_events(event_dict, self.deadline)
+
+        self.write(event_updated)
+
+    post = get
+
+
+@stream_request_body
+class StreamExtractHandler(BaseHandler):
+    """
+    Codes a newline-delimited JSON upload of {text, id, date} documents. The
+    documents in each chunk of the body are parsed together, and every story is
+    written back as one JSON line as soon as it has been coded. The next chunk is
+    only read once the current one is done, so memory use does not grow with
+    the size of the upload. Lines that are not valid documents get an error line.
+
+    A stream can run for hours, so it is not held to a deadline or to the admission
+    of the other endpoints. Instead at most options.max_streams run at once, and
+    a stream beyond that is turned away with a 503. Each stream hands its stories
+    to the coding thread one at a time, so the stories of admitted requests are
+    coded in between rather than waiting for the stream to end.
+    """
+    admitted = False
+
+    @gen.coroutine
+    def prepare(self):
+        yield stream_admission.acquire(IOLoop.current().time() + options.deadline)
+        self.admitted = True
+        self.request.connection.set_max_body_size(STREAM_MAX_BODY_SIZE)
+        self.set_header('Content-Type', 'application/x-ndjson')
+        self.partial = b''
+        self.lineno = 0
+
+    def data_received(self, chunk):
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()
+        # returning the future holds back the next chunk until it is done
+        return self.code_lines(lines)
+
+    @gen.coroutine
+    def post(self):
+        yield self.code_lines([self.partial])
+        self.finish()
+
+    @gen.coroutine
+    def code_lines(self, lines):
+        docs = []
+        for line in lines:
+            self.lineno += 1
+            if not line.strip():
+                continue
+            try:
+                doc = json.loads(line)
+                check_document(doc)
+            except (ValueError, HTTPError):
+                self.write_line({'error': 'Bad request', 'line': self.lineno})
+                continue
+            docs.append(doc)
+        if not docs:
+            return
+
+        texts = [doc['text'].encode('utf-8') for doc in docs]
+        outputs = yield parse_texts(texts)
+        for doc, out in zip(docs, outputs):
+            event_dict = process_corenlp(out, doc['date'], doc['id'])
+            event_updated = yield code_events(event_dict)
+            self.write_line(event_updated)
+            yield self.flush()
+
+    def write_line(self, obj):
+        self.write(json.dumps(obj) + '\n')
+
+    def release(self):
+        if self.admitted:
+            stream_admission.release()
+            self.admitted = False
+
+    def on_finish(self):
+        BaseHandler.on_finish(self)
+        self.release()
+
+    def on_connection_close(self):
+        # an upload that breaks off never finishes
+        BaseHandler.on_connection_close(self)
+        self.release()
+
+
+class CodeHandler(AdmittedHandler):
+    """
+    Codes documents that already have Penn Treebank parses, without calling
+    CoreNLP: a {id, date, sents: [{content, parsed}]} document or a list of
+    them. The parses are normalized as in process_corenlp(); the result is keyed
+    by story id.
+    """
+    @gen.coroutine
+    def get(self):
+        docs = self.get_json_body()
+        if isinstance(docs, dict):
+            docs = [docs]
+        if not isinstance(docs, list):
+            raise HTTPError(400)
+        for doc in docs:
+            check_parsed_document(doc)
+        check_unique_ids(docs)
+
+        event_dict = {}
+        for doc in docs:
+            event_dict[doc['id']] = {
+                'meta': {'date': doc['date']},
+                'sents': {str(i): {'content': sent['content'],
+                                   'parsed': normalize_parse(sent['parsed'])}
+                          for i, sent in enumerate(doc['sents'])}}
+        event_updated = yield code_events(event_dict, self.deadline)
+
+        self.write(event_updated)
 
-        return event_updated
+    post = get
 
 
-def send_to_ccnlp(text):
+def check_parsed_document(doc):
+    """ Raises a 400 unless doc has an id, a date and a list of parsed sents. """
+    if not isinstance(doc, dict) or not (doc.get('id') and doc.get('date')):
+        raise HTTPError(400)
+    check_date(doc['date'])
+    sents = doc.get('sents')
+    if not isinstance(sents, list) or not all(
+            isinstance(sent, dict) and sent.get('content') and sent.get('parsed') and
+            isinstance(sent['content'], basestring) and
+            isinstance(sent['parsed'], basestring)
+            for sent in sents):
+        raise HTTPError(400)
+
+
+def code_stories(event_dict):
+    """
+    Runs do_coding() and records the version of the dictionaries it used in the
+    meta of every story. Runs on the coding thread, like the dictionary swaps.
+    """
+    event_updated = petrarch.do_coding(event_dict, None)
+    for story in event_updated.values():
+        story['meta']['dictionary_version'] = PETRglobals.DictionaryVersion
+    return event_updated
+
+
+@gen.coroutine
+def code_events(event_dict, deadline=None):
+    """
+    Runs code_stories() on the coding thread. If deadline passes first, the stories
+    are dropped from the thread's queue -- unless coding has already started --
+    and a 503 is raised.
+    """
+    future = coding_executor.submit(code_stories, event_dict)
+    if deadline is None:
+        event_updated = yield future
+        raise gen.Return(event_updated)
+
+    @gen.coroutine
+    def wait():
+        event_updated = yield future
+        raise gen.Return(event_updated)
+    try:
+        event_updated = yield gen.with_timeout(deadline, wait())
+    except gen.TimeoutError:
+        future.cancel()
+        raise HTTPError(503, reason='Deadline exceeded')
+    raise gen.Return(event_updated)
+
+
+@gen.coroutine
+def send_to_ccnlp(text, deadline=None):
+    timeout = CCNLP_TIMEOUT
+    if deadline is not None:
+        timeout = min(timeout, time_left(deadline))
     headers = {'Content-Type': 'application/json'}
     core_data = json.dumps({'text': text})
-    ccnlp_url = 'http://ccnlp:5000/process'    
-    r = requests.post(ccnlp_url, data=core_data, headers=headers)
-    out = r.json()
-    return out
+    request = HTTPRequest(CCNLP_URL, method='POST', headers=headers,
+                          body=core_data, request_timeout=timeout)
+    try:
+        with PETRmetrics.StageSeconds.time('ccnlp'):
+            r = yield AsyncHTTPClient().fetch(request)
+    except HTTPClientError as e:
+        if e.code == 599 and deadline is not None:
+            time_left(deadline)  # a 503 if it was our deadline that expired
+        raise
+    out = json.loads(r.body)
+    raise gen.Return(out)
+
+
+@gen.coroutine
+def parse_texts(texts, deadline=None):
+    """
+    Returns the ccnlp output for each of texts, taking what it can from the parse
+    cache and sending the rest to the parser through the batcher. The cache is read
+    and written a batch at a time on the cache thread; the writes are not waited on.
+    """
+    outputs = yield cache_executor.submit(parse_cache.get_many, texts)
+    missing = [k for k, out in enumerate(outputs) if out is None]
+    if missing:
+        parsed = gen.multi_future([batcher.parse(texts[k], deadline)
+                                   for k in missing])
+        if deadline is not None:
+            try:
+                parsed = yield gen.with_timeout(
+                    deadline, parsed, quiet_exceptions=(HTTPError, HTTPClientError))
+            except gen.TimeoutError:
+                raise HTTPError(503, reason='Deadline exceeded')
+        else:
+            parsed = yield parsed
+        for k, out in zip(missing, parsed):
+            outputs[k] = out
+        cache_executor.submit(parse_cache.put_many,
+                              [(texts[k], outputs[k]) for k in missing])
+    raise gen.Return(outputs)
+
+
+class ParseBatcher(object):
+    """
+    Coalesces the texts of concurrent requests into shared ccnlp calls. A text
+    waits up to window seconds for others to join it, or until size texts are
+    pending, and the pending texts are then sent with send_batch_to_ccnlp(). A
+    text that is already pending is not sent again.
+    """
+    def __init__(self, window, size):
+        self.window = window
+        self.size = size
+        self.pending = OrderedDict()  # text -> [future, deadline]
+        self.timeout = None
+
+    def parse(self, text, deadline=None):
+        """ Returns a Future for the ccnlp output of text. """
+        if text in self.pending:
+            entry = self.pending[text]
+            if entry[1] is not None:
+                entry[1] = None if deadline is None else max(entry[1], deadline)
+        else:
+            entry = self.pending[text] = [Future(), deadline]
+        if len(self.pending) >= self.size:
+            self.flush()
+        elif self.timeout is None:
+            self.timeout = IOLoop.current().call_later(self.window, self.flush)
+        return entry[0]
+
+    def flush(self):
+        if self.timeout is not None:
+            IOLoop.current().remove_timeout(self.timeout)
+            self.timeout = None
+        while self.pending:
+            count = min(self.size, len(self.pending))
+            self.send([self.pending.popitem(last=False) for _ in range(count)])
+
+    @gen.coroutine
+    def send(self, batch):
+        texts = [text for text, _ in batch]
+        # the call may take as long as the most patient of its requests allows
+        deadlines = [deadline for _, (_, deadline) in batch]
+        deadline = None if None in deadlines else max(deadlines)
+        try:
+            outputs = yield send_batch_to_ccnlp(texts, deadline)
+        except Exception:
+            for _, (future, _) in batch:
+                future.set_exc_info(sys.exc_info())
+        else:
+            for (_, (future, _)), out in zip(batch, outputs):
+                future.set_result(out)
+
+
+# CoreNLP splits sentences on the terminal period, so the texts of a batch are
+# joined with a sentence of their own that marks the document boundaries.
+BATCH_BREAK = 'HYPNOSBATCHBREAK'
+
+
+@gen.coroutine
+def send_batch_to_ccnlp(texts, deadline=None):
+    """
+    Parses a list of texts with a single ccnlp call and returns one ccnlp output
+    per text. If the boundary sentences did not survive the parse -- e.g. a text
+    without final punctuation pulled the marker into its last sentence -- the
+    texts are sent individually instead.
+    """
+    if len(texts) == 1:
+        out = yield send_to_ccnlp(texts[0], deadline)
+        raise gen.Return([out])
+    joined = ' {} . '.format(BATCH_BREAK).join(texts)
+    out = yield send_to_ccnlp(joined, deadline)
+    outputs = split_ccnlp_output(out, len(texts))
+    if outputs is None:
+        outputs = yield [send_to_ccnlp(text, deadline) for text in texts]
+    raise gen.Return(outputs)
+
+
+def split_ccnlp_output(output, count):
+    """
+    Splits the sentences of a combined ccnlp output at the BATCH_BREAK sentences;
+    returns None if this does not give exactly count outputs.
+    """
+    outputs = [{'sentences': []}]
+    for sent in output['sentences']:
+        if any(BATCH_BREAK in token for token in sent['tokens']):
+            if sent['tokens'][0] != BATCH_BREAK or len(sent['tokens']) > 2:
+                return None
+            outputs.append({'sentences': []})
+        else:
+            outputs[-1]['sentences'].append(sent)
+    if len(outputs) != count:
+        return None
+    return outputs
 
 
 def process_corenlp(output, date, STORYID):
-    event_dict = {STORYID: {}}
-    event_dict[STORYID]['sents'] = {}
-    event_dict[STORYID]['meta'] = {}
-    event_dict[STORYID]['meta']['date'] = date
-    for i, _ in enumerate(output['sentences']):
-        sents = output['sentences']
-        event_dict[STORYID]['sents'][str(i)] = {}
-        event_dict[STORYID]['sents'][str(i)]['content'] = ' '.join(sents[i]['tokens'])
-        event_dict[STORYID]['sents'][str(i)]['parsed'] = sents[i]['parse'].upper().replace(')', ' )')
+    with PETRmetrics.StageSeconds.time('process_corenlp'):
+        event_dict = {STORYID: {}}
+        event_dict[STORYID]['sents'] = {}
+        event_dict[STORYID]['meta'] = {}
+        event_dict[STORYID]['meta']['date'] = date
+        for i, _ in enumerate(output['sentences']):
+            sents = output['sentences']
+            event_dict[STORYID]['sents'][str(i)] = {}
+            event_dict[STORYID]['sents'][str(i)]['content'] = ' '.join(sents[i]['tokens'])
+            event_dict[STORYID]['sents'][str(i)]['parsed'] = normalize_parse(sents[i]['parse'])
 
     return event_dict
 
 
-api.add_resource(ExtractAPI, '/hypnos/extract')
+def normalize_parse(parse):
+    """ Puts a Penn Treebank parse in the form read_TreeBank() expects. """
+    return parse.upper().replace(')', ' )')
 
-if __name__ == '__main__':
 
+def read_config():
     config = petrarch.utilities._get_data('data/config/', 'PETR_config.ini')
-    print("reading config")
     petrarch.PETRreader.parse_Config(config)
+
+
+def build_dictionaries():
+    """
+    Run in a fresh interpreter by DictionaryReloader: reads the dictionaries,
+    rewriting the snapshot if they have changed.
+    """
+    read_config()
+    petrarch.read_dictionaries()
+
+
+def swap_dictionaries():
+    """
+    Loads the dictionaries -- from the fresh snapshot if there is one. Any files
+    are read by this process alone, as a process pool would be forked from one
+    that runs threads. If they cannot be read the old dictionaries stay in use.
+    """
+    petrarch.read_dictionaries(processes=1)
+    return PETRglobals.DictionaryVersion
+
+
+def get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None  # being replaced
+
+
+class DictionaryReloader(object):
+    """
+    Replaces the dictionaries without a restart. With a snapshot_name in the
+    config, a new snapshot is first built by a separate interpreter while
+    requests are served as usual; it is then loaded on the coding thread between
+    two do_coding() calls, so stories that are being coded finish on the old
+    dictionaries. Only the builder -- the first of the forked processes --
+    watches the dictionary files; every process watches the snapshot and loads
+    it once it has been rewritten.
+
+    Without a snapshot each process watches the files itself and reads them on
+    its coding thread, which holds up its coding meanwhile.
+    """
+    def __init__(self, builder):
+        self.builder = builder
+        self.future = None
+        self.mtimes = self.get_mtimes()
+        self.snapshot_mtime = get_mtime(self.get_snapshot_path())
+
+    def get_mtimes(self):
+        return [get_mtime(path) for path in petrarch.get_dictionary_paths()]
+
+    def get_snapshot_path(self):
+        if PETRglobals.SnapshotFileName == "":
+            return ''
+        return petrarch.utilities._get_data('data/dictionaries',
+                                            PETRglobals.SnapshotFileName)
+
+    def reload(self):
+        """ Returns a Future for the new dictionary version. """
+        if self.future is None:
+            self.future = self.build_and_swap(build=True)
+        return self.future
+
+    @gen.coroutine
+    def build_and_swap(self, build):
+        try:
+            # recorded before the build, so that files edited meanwhile are
+            # seen by the next check
+            mtimes = self.get_mtimes()
+            snapshot_path = self.get_snapshot_path()
+            if build and snapshot_path:
+                # a fresh interpreter rather than a fork of this process, which
+                # runs threads
+                child = Subprocess([sys.executable, '-c',
+                                    'import app; app.build_dictionaries()'],
+                                   cwd=cwd)
+                yield child.wait_for_exit()
+            snapshot_mtime = get_mtime(snapshot_path)
+            version = yield coding_executor.submit(swap_dictionaries)
+            self.mtimes = mtimes
+            self.snapshot_mtime = snapshot_mtime
+        finally:
+            self.future = None
+        raise gen.Return(version)
+
+    def check(self):
+        """
+        Starts a reload if any of the dictionary files has been edited, or loads
+        the snapshot if another process has rewritten it.
+        """
+        if self.future is not None:
+            return
+        snapshot_path = self.get_snapshot_path()
+        if ((self.builder or not snapshot_path) and
+                self.get_mtimes() != self.mtimes):
+            future = self.reload()
+        elif snapshot_path and get_mtime(snapshot_path) != self.snapshot_mtime:
+            future = self.future = self.build_and_swap(build=False)
+        else:
+            return
+        IOLoop.current().add_future(future, self.log_failure)
+
+    def log_failure(self, future):
+        # the dictionaries in use are kept, and the next check tries again
+        if future.exception() is not None:
+            app_log.error('Could not reload the dictionaries',
+                          exc_info=future.exc_info())
+
+
+class ReloadHandler(BaseHandler):
+    """
+    Rebuilds the dictionaries, loads them in the process that serves the
+    request and returns its old and new dictionary versions. The other processes
+    only load them if they watch the snapshot [see DictionaryReloader].
+    """
+    @gen.coroutine
+    def post(self):
+        previous = PETRglobals.DictionaryVersion
+        version = yield reloader.reload()
+        self.write({'previous_version': previous, 'dictionary_version': version})
+
+
+def make_app():
+    global parse_cache, admission, stream_admission, batcher, reloader
+    parse_cache = PETRcache.ParseCache(options.parse_cache,
+                                       options.parser_version,
+                                       options.parse_cache_size,
+                                       options.parse_cache_timeout)
+    admission = Admission(options.max_active, options.max_queued)
+    stream_admission = Admission(options.max_streams, 0)
+    batcher = ParseBatcher(options.batch_window / 1000.0, options.batch_size)
+    # task_id() is None without fork_processes()
+    reloader = DictionaryReloader(task_id() in (None, 0))
+    return Application([
+        (r'/hypnos/extract', ExtractHandler),
+        (r'/hypnos/extract/batch', BatchExtractHandler),
+        (r'/hypnos/extract/stream', StreamExtractHandler),
+        (r'/hypnos/code', CodeHandler),
+        (r'/metrics', MetricsHandler),
+        (r'/hypnos/admin/reload', ReloadHandler),
+    ], default_handler_class=NotFoundHandler)
+
+
+if __name__ == '__main__':
+
+    parse_command_line()
+
+    print("reading config")
+    read_config()
     print("reading dicts")
     petrarch.read_dictionaries()
 
-    http_server = HTTPServer(WSGIContainer(app))
-    http_server.listen(5002)
+    # The dictionaries are read once, before forking, so the workers share the
+    # PETRglobals pages copy-on-write. Collecting first keeps the children from
+    # touching those pages to clean up garbage left over from the load.
+    sockets = bind_sockets(options.port)
+    if options.processes != 1:
+        gc.collect()
+        fork_processes(options.processes)
+
+    http_server = HTTPServer(make_app())
+    http_server.add_sockets(sockets)
+    if options.watch_dictionaries > 0:
+        PeriodicCallback(reloader.check,
+                         options.watch_dictionaries * 1000).start()
     IOLoop.instance().start()
@@ -0,0 +1,147 @@
+##	PETRcache.py [module]
+##
+# Caches for the PETRARCH event coder
+##
+# SYSTEM REQUIREMENTS
+# This program has been successfully run under Mac OS 10.10; it is standard Python 2.7
+# so it should also run in Unix or Windows.
+#
+# This project is part of the Open Event Data Alliance tool set
+#
+# This code is covered under the MIT license
+#
+# REVISION HISTORY:
+# Oct-26:	Initial version: parse cache
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+import hashlib
+import sqlite3
+from collections import OrderedDict
+
+# keys per SELECT; SQLite allows at most 999 parameters in a statement
+MaxQueryKeys = 500
+
+
+class LRUCache(object):
+    """
+    Bounded in-memory mapping that drops the least recently used entry once it
+    holds maxsize entries. A maxsize of zero disables the cache.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            return default
+        self.entries[key] = value  # move to the most recently used end
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ParseCache(object):
+    """
+    Content-addressed cache of parser output. Entries are keyed on the SHA-1 of the
+    whitespace-normalized text together with a parser version tag, so changing the
+    parser or its models only requires a new tag. Lookups go to a bounded LRU in
+    memory first and then, if a path is given, to a SQLite file that persists across
+    runs and can be shared by several processes. Values must be JSON-serializable.
+
+    timeout is the number of seconds to wait for another process's lock on the file;
+    a lookup or write that times out is logged and treated as a miss or skipped.
+    get_many() and put_many() take a whole batch of texts in one query and one
+    transaction.
+    """
+
+    def __init__(self, path='', version='', size=10000, timeout=30):
+        self.version = version
+        self.memory = LRUCache(size)
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=timeout,
+                                      check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS parses '
+                            '(key TEXT PRIMARY KEY, value TEXT)')
+            self.db.commit()
+
+    def make_key(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        normalized = ' '.join(text.split())
+        return hashlib.sha1((self.version + '\n' + normalized).encode('utf-8')
+                            ).hexdigest()
+
+    def get(self, text):
+        """ Returns the cached output for text, or None if it has not been seen. """
+        return self.get_many([text])[0]
+
+    def get_many(self, texts):
+        """
+        Returns the cached output for each of texts, None for those that have not
+        been seen; the ones that are not in memory are looked up in one query.
+        """
+        keys = [self.make_key(text) for text in texts]
+        values = [self.memory.get(key) for key in keys]
+        missing = [k for k, value in enumerate(values) if value is None]
+        if missing and self.db is not None:
+            wanted = list(set(keys[k] for k in missing))
+            rows = {}
+            try:
+                for ka in range(0, len(wanted), MaxQueryKeys):
+                    chunk = wanted[ka:ka + MaxQueryKeys]
+                    rows.update(self.db.execute(
+                        'SELECT key, value FROM parses WHERE key IN ({})'.format(
+                            ', '.join('?' * len(chunk))), chunk))
+            except sqlite3.Error as e:
+                logger = logging.getLogger('petr_log')
+                logger.warning('Parse cache lookup failed: {}'.format(e))
+            for k in missing:
+                if keys[k] in rows:
+                    values[k] = json.loads(rows[keys[k]])
+                    self.memory.put(keys[k], values[k])
+        return values
+
+    def put(self, text, value):
+        self.put_many([(text, value)])
+
+    def put_many(self, items):
+        """ Stores the (text, value) pairs of items, on disk in a single transaction. """
+        rows = []
+        for text, value in items:
+            key = self.make_key(text)
+            self.memory.put(key, value)
+            rows.append((key, json.dumps(value)))
+        if self.db is not None and rows:
+            try:
+                with self.db:  # commits, or rolls back if the write fails
+                    self.db.executemany(
+                        'INSERT OR REPLACE INTO parses VALUES (?, ?)', rows)
+            except sqlite3.Error as e:
+                logger = logging.getLogger('petr_log')
+                logger.warning('Parse cache write failed: {}'.format(e))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
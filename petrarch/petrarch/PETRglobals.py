@@ -34,10 +34,21 @@
 VerbDict = {}  # verb dictionary
 ActorDict = {}  # actor dictionary
 ActorCodes = []  # actor code list
+ActorCodeDates = []  # ActorCodes compiled by PETRreader.make_actor_dates()
+ActorCodeMemo = {}  # get_actor_code() results by (index, date)
 AgentDict = {}  # agent dictionary
+ActorTries = {}  # ActorDict compiled by PETRreader.make_pattern_trie()
+AgentTries = {}  # AgentDict compiled by PETRreader.make_pattern_trie()
 DiscardList = {}  # discard list
+DiscardPhrases = []  # [phrase, '$' or '+'] of each phrase in DiscardList
+DiscardAutomaton = ([{}], [0], [[]])  # DiscardPhrases matcher
 IssueList = []
 IssueCodes = []
+IssueAutomaton = ([{}], [0], [[]])  # IssueList matcher, see PETRreader.make_phrase_automaton()
+DictionaryVersion = ""  # SHA-1 of the dictionary files that were read
+ActorDateCuts = []  # ordinal dates where actor date restrictions change
+CodingCache = None  # coded sentences, see petrarch.code_parse()
+DictionaryStore = None  # PETRstore.MappedStore used instead of the actor dicts
 
 ConfigFileName = "PETR_config.ini"
 VerbFileName = ""  # verb dictionary
@@ -47,6 +58,9 @@ DiscardFileName = ""  # discard list
 TextFileList = []  # current text or validation file
 EventFileName = ""  # event output file
 IssueFileName = ""  # issues list
+SnapshotFileName = ""  # compiled dictionaries, see petrarch.read_dictionaries()
+StoreFileName = ""  # memory-mapped actors and agents, see PETRstore.py
+LoadProcesses = 1  # processes that read the dictionary files
 
 # element followed by attribute and content pairs for XML line
 AttributeList = []
@@ -56,6 +70,8 @@ AttributeList = []
 NewActorLength = 0  # Maximum length for new actors extracted from noun phrases
 RequireDyad = True  # Events require a non-null source and target
 StoponError = False  # Raise stop exception on errors rather than recovering
+CodingCacheSize = 10000  # Number of coded sentences kept in memory; 0 disables
+ActorCodeMemoSize = 100000  # get_actor_code() results kept before the memo is cleared
 
 # OUTPUT OPTIONS
 WriteActorRoot = False  # Include actor root in event record
@@ -86,6 +102,8 @@ CommaEMin = 2
 CommaEMax = 8
 
 stanfordnlp = ''
+ParseCacheFile = ""  # SQLite file for the persistent parse cache; memory only if empty
+ParserVersion = ""  # tag included in the parse cache keys
 
 # TEMPORARY VARIABLES
 # <14.11.20> Temporary in the sense that these won't be needed when we eventually
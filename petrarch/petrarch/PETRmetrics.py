@@ -0,0 +1,134 @@
+##	PETRmetrics.py [module]
+##
+# Prometheus-style metrics for the PETRARCH event coder
+##
+# SYSTEM REQUIREMENTS
+# This program has been successfully run under Mac OS 10.10; it is standard Python 2.7
+# so it should also run in Unix or Windows.
+#
+# This project is part of the Open Event Data Alliance tool set
+#
+# This code is covered under the MIT license
+#
+# REVISION HISTORY:
+# Oct-26:	Initial version: stage timings and coding counters
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# latencies from a sub-millisecond tree pass up to a long parser call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+REGISTRY = []
+
+
+class Metric(object):
+    """
+    Base of the metric types: a named value per value of an optional label,
+    safe to update from the coding thread and the server thread at once.
+    Every metric adds itself to REGISTRY, which expose() writes out.
+    """
+    kind = ''
+
+    def __init__(self, name, doc, label=None):
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def format_labels(self, label_value, extra=''):
+        labels = []
+        if self.label is not None:
+            labels.append('{}="{}"'.format(self.label, label_value))
+        if extra:
+            labels.append(extra)
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            for label_value in sorted(self.values):
+                lines.extend(self.samples(label_value, self.values[label_value]))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, label_value=None):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self, label_value, value):
+        return ['{}{} {}'.format(self.name, self.format_labels(label_value), value)]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, label=None, buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, doc, label)
+        self.buckets = buckets
+
+    def observe(self, value, label_value=None):
+        with self.lock:
+            if label_value not in self.values:
+                # per-bucket counts, the last for values above every bound; sum
+                self.values[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = self.values[label_value]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, label_value=None):
+        """ Observes the time spent in the with-block. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, label_value)
+
+    def samples(self, label_value, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, self.format_labels(label_value, 'le="{}"'.format(bound)),
+                cumulative))
+        labels = self.format_labels(label_value)
+        lines.append('{}_sum{} {}'.format(self.name, labels, repr(total)))
+        lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+def expose():
+    """ Returns every registered metric in the Prometheus text format. """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+StageSeconds = Histogram('petrarch_stage_seconds',
+                         'Time spent in each stage of parsing and coding.',
+                         'stage')
+Stories = Counter('petrarch_stories_total', 'Stories coded.')
+Sentences = Counter('petrarch_sentences_total', 'Sentences coded.')
+Events = Counter('petrarch_events_total', 'Events generated.')
+EmptySentences = Counter('petrarch_empty_sentences_total',
+                         'Coded sentences that generated no events.')
+Discards = Counter('petrarch_discards_total',
+                   'Sentences and stories dropped by the discard list.', 'kind')
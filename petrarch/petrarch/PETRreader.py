@@ -39,7 +39,11 @@ import re
 import os
 import sys
 import math  # required for ordinal date calculations
+import hashlib
+import marshal
+import gc
 import logging
+import multiprocessing
 import xml.etree.ElementTree as ET
 
 try:
@@ -135,9 +139,28 @@ def parse_Config(config_path):
         PETRglobals.DiscardFileName = parser.get(
             'Dictionaries',
             'discardfile_name')
+        if parser.has_option('Dictionaries', 'snapshot_name'):
+            PETRglobals.SnapshotFileName = parser.get('Dictionaries',
+                                                      'snapshot_name')
+        if parser.has_option('Dictionaries', 'store_name'):
+            PETRglobals.StoreFileName = parser.get('Dictionaries', 'store_name')
+        if parser.has_option('Dictionaries', 'load_processes'):
+            try:
+                PETRglobals.LoadProcesses = parser.getint('Dictionaries',
+                                                          'load_processes')
+            except ValueError:
+                print(
+                    "Error in config.ini Dictionaries: load_processes value must be an integer")
+                raise
 
         direct = parser.get('StanfordNLP', 'stanford_dir')
         PETRglobals.stanfordnlp = os.path.expanduser(direct)
+        if parser.has_option('StanfordNLP', 'parse_cache'):
+            PETRglobals.ParseCacheFile = os.path.expanduser(
+                parser.get('StanfordNLP', 'parse_cache'))
+        if parser.has_option('StanfordNLP', 'parser_version'):
+            PETRglobals.ParserVersion = parser.get('StanfordNLP',
+                                                   'parser_version')
 
         filestring = parser.get('Dictionaries', 'actorfile_list')
         PETRglobals.ActorFileList = filestring.split(', ')
@@ -185,6 +208,16 @@ def parse_Config(config_path):
                 raise
         print("new_actor_length =", PETRglobals.NewActorLength)
 
+        if parser.has_option('Options', 'coding_cache_size'):
+            try:
+                PETRglobals.CodingCacheSize = parser.getint(
+                    'Options',
+                    'coding_cache_size')
+            except ValueError:
+                print(
+                    "Error in config.ini Option: coding_cache_size value must be an integer")
+                raise
+
         PETRglobals.StoponError = get_config_boolean('stop_on_error')
         PETRglobals.WriteActorRoot = get_config_boolean('write_actor_root')
         PETRglobals.WriteActorText = get_config_boolean('write_actor_text')
@@ -267,44 +300,38 @@ def parse_Config(config_path):
         print("Terminating program")
         sys.exit()
 
-# ================== PRIMARY INPUT USING FIN ================== #
+# ================== DICTIONARY FILE INPUT ================== #
 
+EndOfLines = (0, '')  # what next_line() reads at the end of a DictionaryLines
 
-def open_FIN(filename, descrstr):
-    # opens the global input stream fin using filename;
-    # descrstr provides information about the file in the event it isn't found
-    global FIN
-    global FINline, FINnline, CurrentFINname
-    try:
-        FIN = io.open(filename, 'r', encoding='utf-8')
-        CurrentFINname = filename
-        FINnline = 0
-    except IOError:
-        print("\aError: Could not find the", descrstr, "file:", filename)
-        print("Terminating program")
-        sys.exit()
 
+class DictionaryLines(object):
+    """
+    The (line number, line) records of a dictionary file, which iterating goes
+    through [see read_dictionary_lines()]. lineno is the number of the line that
+    next_line() returned last, so that the readers can say where a problem is.
+    """
 
-def close_FIN():
-    # closes the global input stream fin.
-    # IOError should only happen during debugging or if something has seriously gone wrong
-    # with the system, so exit if this occurs.
-    global FIN
-    try:
-        FIN.close()
-    except IOError:
-        print("\aError: Could not close the input file")
-        print("Terminating program")
-        sys.exit()
+    def __init__(self, filename, records):
+        self.filename = os.path.basename(filename)
+        self.records = iter(records)
+        self.lineno = 0
 
+    def __iter__(self):
+        return self.records
 
-def read_FIN_line():
+    def where(self):
+        """ Returns ' (<file> line <lineno>)', for the end of a message. """
+        return ' ({} line {})'.format(self.filename, self.lineno)
+
+
+def read_dictionary_lines(filename, descrstr):
     """
-    def read_FIN_line():
-    Reads a line from the input stream fin, deleting xml comments and lines beginning with #
-    returns next non-empty line or EOF
-    tracks the current line number (FINnline) and content (FINline)
-    calling function needs to handle EOF (len(line) == 0)
+    Reads filename in one go and returns its (line number, line) records as a
+    DictionaryLines, deleting xml comments and lines beginning with #; blank lines
+    are left out. The lines keep their '\n' and are numbered from 1. descrstr
+    provides information about the file in the event it isn't found. Nothing is
+    kept between calls, so any number of files can be read at once.
     """
     """
 	Comments in input files:
@@ -340,54 +367,62 @@ def read_FIN_line():
 	initial space is required.
 
 	Blank lines and lines with only whitespace are also skipped.
+
+	These are the rules of the line-by-line reader this replaced, quirks included: a
+	line beginning with '<!' is skipped whole, and the line following a multi-line
+	comment is kept as it is.
 	"""
-    global FIN
-    global FINline, FINnline
-
-    line = FIN.readline()
-    FINnline += 1
-    while True:
-        if len(line) == 0:
-            break  # calling function needs to handle EOF
+    try:
+        with io.open(filename, 'r', encoding='utf-8') as fin:
+            text = fin.read()
+    except IOError:
+        print("\aError: Could not find the", descrstr, "file:", filename)
+        print("Terminating program")
+        sys.exit()
+
+    pieces = text.split('\n')
+    lines = [piece + '\n' for piece in pieces[:-1]]
+    if pieces[-1]:
+        lines.append(pieces[-1])  # no newline at the end of the file
+    nlines = len(lines)
+
+    records = []
+    kline = 0
+    while kline < nlines:
+        line = lines[kline]
+        kline += 1
         # deal with simple lines we need to skip
-        if line[0] == '#' or line[0] == '\n' or line[
-                0:2] == '<!' or len(line.strip()) == 0:
-            line = FIN.readline()
-            FINnline += 1
+        if line[0] == '#' or line[0] == '\n' or line[0:2] == '<!':
             continue
-        if not line:  # handle EOF
-            print("EOF hit in read_FIN_line()")
-            raise EOFError
-            return line
         if ('#' in line):
             line = line[:line.find('#')]
         if ('<!--' in line):
             if ('-->' in line):  # just remove the substring
                 pline = line.partition('<!--')
                 line = pline[0] + pline[2][pline[2].find('-->') + 3:]
-            else:
-                while ('-->' not in line):
-                    line = FIN.readline()
-                    FINnline += 1
-                line = FIN.readline()
-                FINnline += 1
+            else:  # skip to the end of the comment, and keep the line after it
+                while kline < nlines and '-->' not in lines[kline]:
+                    kline += 1
+                kline += 1
+                if kline >= nlines:
+                    break
+                line = lines[kline]
+                kline += 1
         if len(line.strip()) > 0:
-            break
-        line = FIN.readline()
-        FINnline += 1
-    FINline = line
-    return line
+            records.append((kline, line))
+    return DictionaryLines(filename, records)
 
 
-# ========================== TAG EVALUATION FUNCTIONS ========================== #
+def next_line(lines):
+    """
+    Returns the line of the next record of lines, or '' at the end of them, and
+    keeps its number in lines.lineno.
+    """
+    lines.lineno, line = next(lines.records, EndOfLines)
+    return line
 
-def find_tag(tagstr):
-    # reads fin until tagstr is found
-    # can inherit EOFError raised in PETRreader.read_FIN_line()
-    line = read_FIN_line()
-    while (tagstr not in line):
-        line = read_FIN_line()
 
+# ========================== TAG EVALUATION FUNCTIONS ========================== #
 
 def extract_attributes(theline):
     # puts list of attribute and content pairs in the global AttributeList. First item is
@@ -446,6 +481,176 @@ def get_attribute(targattr):
         return ""
 
 
+# ================== DICTIONARY VERSIONS ================== #
+
+def get_dictionary_version(paths):
+    """
+    Returns the SHA-1 of the names and contents of the dictionary files in paths. This
+    changes whenever one of the files is edited, so anything computed from the
+    dictionaries can be keyed on it.
+    """
+    sha = hashlib.sha1()
+    for path in paths:
+        sha.update(os.path.basename(path).encode('utf-8') + b'\n')
+        with io.open(path, 'rb') as fin:
+            sha.update(fin.read())
+    return sha.hexdigest()
+
+
+def get_restriction_cuts(codelist):
+    """
+    Returns the set of ordinal dates at which one of the date restrictions of the
+    ActorCodes entry codelist starts or stops applying.
+    """
+    cuts = set()
+    for item in codelist:
+        if not isinstance(item, list) or len(item) == 1:
+            continue  # unrestricted code or the actor root
+        if item[0] == 0:  # date <= ordate
+            cuts.add(item[1] + 1)
+        elif item[0] == 1:  # date >= ordate
+            cuts.add(item[1])
+        else:  # ordate <= date <= ordate
+            cuts.add(item[1])
+            cuts.add(item[2] + 1)
+    return cuts
+
+
+def get_actor_date_cuts(actorcodes=None):
+    """
+    Returns the sorted ordinal dates at which one of the date restrictions in
+    actorcodes, by default PETRglobals.ActorCodes, starts or stops applying. Two
+    dates with no cut between them -- the same bisect.bisect_right() index --
+    resolve every actor code the same way in get_actor_code().
+    """
+    if actorcodes is None:
+        actorcodes = PETRglobals.ActorCodes
+    cuts = set()
+    for codelist in actorcodes:
+        cuts.update(get_restriction_cuts(codelist))
+    return sorted(cuts)
+
+
+def resolve_actor_code(codelist, date):
+    """
+    Returns the code of the ActorCodes entry codelist on the ordinal date: the
+    first date restriction that applies, otherwise the last unrestricted code,
+    otherwise '---'. If PETRglobals.WriteActorRoot, the actor root follows a code
+    after PETRglobals.RootPrimer.
+    """
+    thecode = None
+    if len(codelist) == 1 and len(codelist[0]) == 1:
+        thecode = codelist[0][0]  # no restrictions: the most common case
+    for item in codelist:
+        if len(item) > 1:  # interval date restriction
+            if item[0] == 0 and date <= item[1]:
+                thecode = item[2]
+                break
+            if item[0] == 1 and date >= item[1]:
+                thecode = item[2]
+                break
+            if item[0] == 2 and date >= item[1] and date <= item[2]:
+                thecode = item[3]
+                break
+    # if interval search failed, look for an unrestricted code
+    if not thecode:
+        # assumes even if PETRglobals.WriteActorRoot, the actor name at the end
+        # of the list will have length >1 if
+        for item in codelist:
+            if len(item) == 1:
+                thecode = item[0]
+
+    if not thecode:
+        thecode = '---'
+    elif PETRglobals.WriteActorRoot:
+        thecode += PETRglobals.RootPrimer + codelist[-1]
+    return thecode
+
+
+def make_actor_dates(codelist):
+    """
+    Compiles the ActorCodes entry codelist into (cuts, codes) for get_actor_code():
+    cuts are the sorted get_restriction_cuts() and codes[bisect_right(cuts, date)]
+    is the resolve_actor_code() of the ordinal date, so the code is found without
+    going through the restrictions.
+    """
+    cuts = sorted(get_restriction_cuts(codelist))
+    dates = [cut - 1 for cut in cuts[:1]] + cuts or [0]  # one in each interval
+    return (cuts, [resolve_actor_code(codelist, date) for date in dates])
+
+
+# ================== DICTIONARY SNAPSHOTS ================== #
+
+SnapshotFormat = 6  # increment when the dictionary structures change
+SnapshotGlobals = ('VerbDict', 'ActorDict', 'ActorCodes', 'ActorCodeDates',
+                   'AgentDict', 'ActorTries', 'AgentTries',
+                   'DiscardList', 'DiscardPhrases', 'DiscardAutomaton',
+                   'IssueList', 'IssueCodes', 'IssueAutomaton')
+
+
+def get_snapshot_key(version):
+    """
+    Returns the key stored in a snapshot of the dictionaries with the given
+    get_dictionary_version(): besides the dictionary files it covers the options
+    that change how they are read and the Python version, which fixes the marshal
+    format.
+    """
+    return 'PETRARCH snapshot {} py{} root={} {}'.format(
+        SnapshotFormat, '.'.join(str(v) for v in sys.version_info[:3]),
+        int(PETRglobals.WriteActorRoot), version)
+
+
+def write_dictionary_snapshot(snapshot_path, key, dictionaries):
+    """
+    Writes dictionaries, a dict of the SnapshotGlobals, to snapshot_path, headed
+    by key: each of them is marshalled separately, preceded by a line with its
+    length. The file is written under a temporary name and then renamed, so
+    processes that start meanwhile never see a partial snapshot.
+    """
+    temp_path = '{}.{}.tmp'.format(snapshot_path, os.getpid())
+    try:
+        with io.open(temp_path, 'wb') as fout:
+            fout.write(key.encode('utf-8') + b'\n')
+            for name in SnapshotGlobals:
+                data = marshal.dumps(dictionaries[name])
+                fout.write('{}\n'.format(len(data)).encode('ascii'))
+                fout.write(data)
+        os.rename(temp_path, snapshot_path)
+    except (IOError, OSError) as e:
+        logger = logging.getLogger('petr_log')
+        logger.warning('Could not write dictionary snapshot: {}'.format(e))
+
+
+def read_dictionary_snapshot(snapshot_path, key, skip=()):
+    """
+    Returns the dictionaries in snapshot_path as a dict of the SnapshotGlobals if
+    the file exists and was written with key, otherwise None. The globals named in
+    skip are passed over and left out of the dict.
+    """
+    data = {}
+    try:
+        with io.open(snapshot_path, 'rb') as fin:
+            if fin.readline() != key.encode('utf-8') + b'\n':
+                return None
+            # the dictionaries are millions of containers that will not be freed,
+            # and collecting while they are created costs most of the load time
+            gcenabled = gc.isenabled()
+            gc.disable()
+            try:
+                for name in SnapshotGlobals:
+                    size = int(fin.readline())
+                    if name in skip:
+                        fin.seek(size, 1)
+                        continue
+                    data[name] = marshal.loads(fin.read(size))
+            finally:
+                if gcenabled:
+                    gc.enable()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    return data
+
+
 # ================== ANCILLARY DICTIONARY INPUT ================== #
 
 def read_discard_list(discard_path):
@@ -460,8 +665,8 @@ def read_discard_list(discard_path):
 
     The file format allows # to be used as a in-line comment delimiter.
 
-    File is stored as a dictionary search tree and the interpretation of the strings is done in
-    check_discards()
+    File is stored as a dictionary search tree, which make_discard_automaton() compiles
+    for check_discards()
 
     ===== EXAMPLE =====
     +5K RUN #  ELH 06 Oct 2009
@@ -491,9 +696,9 @@ def read_discard_list(discard_path):
 
     logger = logging.getLogger('petr_log')
     logger.info("Reading " + PETRglobals.DiscardFileName)
-    open_FIN(discard_path, "discard")
+    lines = read_dictionary_lines(discard_path, "discard")
 
-    line = read_FIN_line()
+    line = next_line(lines)
     while len(line) > 0:  # loop through the file
         if '#' in line:
             line = line[:line.find('#')]
@@ -511,8 +716,31 @@ def read_discard_list(discard_path):
             list = list.setdefault(targ[0], {})
             targ = targ[1:]
 
-        line = read_FIN_line()
-    close_FIN()
+        line = next_line(lines)
+    make_discard_automaton()
+
+
+def make_discard_automaton():
+    """
+    Compiles the phrases of the DiscardList search tree into
+    PETRglobals.DiscardPhrases, as [phrase, '$' or '+'] in alphabetical order,
+    and a word-level PETRglobals.DiscardAutomaton [see make_phrase_automaton()]
+    over them, so that check_discards() finds every discard in the sentence in
+    one pass.
+    """
+    phrases = []
+
+    def walk(level, words):
+        for word in sorted(level):
+            if word in ('$', '+'):
+                phrases.append([' '.join(words), word])
+            else:
+                walk(level[word], words + [word])
+
+    walk(PETRglobals.DiscardList, [])
+    PETRglobals.DiscardPhrases = phrases
+    PETRglobals.DiscardAutomaton = make_phrase_automaton(
+        [phrase[0].split() for phrase in phrases])
 
 
 def read_issue_list(issue_path):
@@ -580,12 +808,12 @@ def read_issue_list(issue_path):
     """
     logger = logging.getLogger('petr_log')
     logger.info("Reading " + PETRglobals.IssueFileName)
-    open_FIN(issue_path, "issues")
+    lines = read_dictionary_lines(issue_path, "issues")
 
     PETRglobals.IssueCodes.append('~')  # initialize the ignore codes
     PETRglobals.IssueCodes.append('~~')
 
-    line = read_FIN_line()
+    line = next_line(lines)
     while len(line) > 0:  # loop through the file
         if '#' in line:
             line = line[:line.find('#')]
@@ -598,7 +826,7 @@ def read_issue_list(issue_path):
                 codeindex = 0
         else:
             if '[' not in line:  # just do the codes now
-                line = read_FIN_line()
+                line = next_line(lines)
                 continue
             code = line[line.find('[') + 1:line.find(']')]  # get the code
             if code in PETRglobals.IssueCodes:
@@ -650,8 +878,44 @@ def read_issue_list(issue_path):
 
         for item in forms:
             PETRglobals.IssueList.append(tuple([' ' + item + ' ', codeindex]))
-        line = read_FIN_line()
-    close_FIN()
+        line = next_line(lines)
+    PETRglobals.IssueAutomaton = make_phrase_automaton(
+        [target[0] for target in PETRglobals.IssueList])
+
+
+def make_phrase_automaton(phrases):
+    """
+    Compiles phrases, which are sequences of characters or of words, into an
+    Aho-Corasick automaton so that all of them are found in a single pass over a
+    sentence. Returns (goto, fail, out), indexed by state: goto holds the
+    transitions, fail the state to fall back to when there is none, and out the
+    indices in phrases of the phrases that end at the state, including those
+    reached through the fail links. State 0 is the root.
+    """
+    goto = [{}]
+    out = [[]]
+    for index, phrase in enumerate(phrases):
+        state = 0
+        for char in phrase:
+            if char not in goto[state]:
+                goto[state][char] = len(goto)
+                goto.append({})
+                out.append([])
+            state = goto[state][char]
+        out[state].append(index)
+
+    # breadth-first, so the fail state of a state is done before the state
+    fail = [0] * len(goto)
+    queue = list(goto[0].values())
+    for state in queue:
+        for char, nextstate in goto[state].items():
+            queue.append(nextstate)
+            back = fail[state]
+            while back and char not in goto[back]:
+                back = fail[back]
+            fail[nextstate] = goto[back].get(char, 0)
+            out[nextstate] = out[nextstate] + out[fail[nextstate]]
+    return (goto, fail, out)
 
 
 # ================== VERB DICTIONARY INPUT ================== #
@@ -946,7 +1210,8 @@ def read_verb_dictionary(verb_path):
                     exit()
 
                     logger.warning("Synset " + phlist[ka] +
-                                   " has not been defined; pattern skipped")
+                                   " has not been defined; pattern skipped" +
+                                   lines.where())
                     raise ValueError  # this will do...
             ka += 2
         return phlist
@@ -1015,7 +1280,8 @@ def read_verb_dictionary(verb_path):
                     phrase +
                     ' in ' +
                     verb +
-                    ' is part of a multi-word verb and should contain a +; this was skipped')
+                    ' is part of a multi-word verb and should contain a +; this was skipped' +
+                    lines.where())
 
     def make_verb_forms(loccode, line):
         """ Create the regular forms of a verb. """
@@ -1052,12 +1318,12 @@ def read_verb_dictionary(verb_path):
     # note that this will be ignored if there are no errors
     logger = logging.getLogger('petr_log')
     logger.info("Reading " + PETRglobals.VerbFileName)
-    open_FIN(verb_path, "verb")
+    lines = read_dictionary_lines(verb_path, "verb")
 
     theverb = ''
     newblock = False
     ka = 0   # primary verb count ( debug )
-    line = read_FIN_line()
+    line = next_line(lines)
     while len(line) > 0:  # loop through the file
 
         if '[' in line:
@@ -1073,13 +1339,13 @@ def read_verb_dictionary(verb_path):
             else:
                 primarycode = '---'
             newblock = True
-            line = read_FIN_line()
+            line = next_line(lines)
 
         elif verb[0] == '-':   # pattern
 
             # TABARI legacy: currently aren't processing these
             if '{' in verb:
-                line = read_FIN_line()
+                line = next_line(lines)
                 continue
             # resolve the ambiguous '_ ' construction to ' '
 
@@ -1102,7 +1368,7 @@ def read_verb_dictionary(verb_path):
             except ValueError:
                 # just trap the error, which will skip the line containing it
                 pass
-            line = read_FIN_line()
+            line = next_line(lines)
 
         elif verb[0] == '&':  # Read and store a synset.
 
@@ -1112,7 +1378,7 @@ def read_verb_dictionary(verb_path):
             else:
                 noplural = False
             PETRglobals.VerbDict[verb] = {}
-            line = read_FIN_line()
+            line = next_line(lines)
             while line[0] == '+':
                 wordstr = line[1:].strip()
                 if noplural or wordstr[-1] == '_':
@@ -1138,7 +1404,7 @@ def read_verb_dictionary(verb_path):
                         dict='verbs',
                         line=line)
 
-                line = read_FIN_line()
+                line = next_line(lines)
 
         else:  # verb
             if len(code) > 0:
@@ -1171,9 +1437,7 @@ def read_verb_dictionary(verb_path):
                 else:
                     make_verb_forms(curcode, line)
             ka += 1   # counting primary verbs
-            line = read_FIN_line()
-
-    close_FIN()
+            line = next_line(lines)
 
 
 
@@ -1441,14 +1705,14 @@ def read_actor_dictionary(actorfile):
 
     logger = logging.getLogger('petr_log')
     logger.info("Reading " + actorfile)
-    open_FIN(actorfile, "actor")
+    lines = read_dictionary_lines(actorfile, "actor")
 
     # location where codes for current actor will be stored
     codeindex = len(PETRglobals.ActorCodes)
     # list of codes -- default and date restricted -- for current actor
     curlist = []
 
-    line = read_FIN_line()
+    line = next_line(lines)
     while len(line) > 0:  # loop through the file
         if '---STOP---' in line:
             break
@@ -1457,8 +1721,8 @@ def read_actor_dictionary(actorfile):
             try:
                 brack = line.index('[')
             except ValueError:
-                logger.warning(dateerrorstr)
-                line = read_FIN_line()
+                logger.warning(dateerrorstr + lines.where())
+                line = next_line(lines)
                 continue
             part = line[brack + 1:].strip().partition(' ')
             code = part[0].strip()
@@ -1477,8 +1741,8 @@ def read_actor_dictionary(actorfile):
                 try:
                     ord = dstr_to_ordate(rest[ka:kb])
                 except DateError:
-                    logger.warning(dateerrorstr)
-                    line = read_FIN_line()
+                    logger.warning(dateerrorstr + lines.where())
+                    line = next_line(lines)
                     continue
 
                 if rest[0] == '<':
@@ -1494,13 +1758,14 @@ def read_actor_dictionary(actorfile):
                     pt2 = part2[0].strip()
                     ord2 = dstr_to_ordate(pt2)
                 except DateError:
-                    logger.warning(dateerrorstr)
-                    line = read_FIN_line()
+                    logger.warning(dateerrorstr + lines.where())
+                    line = next_line(lines)
                     continue
                 if ord2 < ord1:
                     logger.warning(
-                        "End date in interval date restriction is less than starting date; line skipped")
-                    line = read_FIN_line()
+                        "End date in interval date restriction is less than starting date; line skipped" +
+                        lines.where())
+                    line = next_line(lines)
                     continue
                 curlist.append([2, ord1, ord2, code])
             else:  # replace default code
@@ -1547,11 +1812,14 @@ def read_actor_dictionary(actorfile):
                 # save location of the list if this is a primary phrase
                 curlist = PETRglobals.ActorDict[keyword]
 
-        line = read_FIN_line()
+        line = next_line(lines)
 
-    close_FIN()
 #    <14.11.20: does this need to save the final entry? >
 
+    # index the date restrictions of the entries added from this file
+    for codelist in PETRglobals.ActorCodes[len(PETRglobals.ActorCodeDates):]:
+        PETRglobals.ActorCodeDates.append(make_actor_dates(codelist))
+
     # sort the patterns by the number of words
     # for lockey in list(PETRglobals.ActorDict.keys()):
     #    PETRglobals.ActorDict[lockey].sort(key=len, reverse=True)
@@ -1696,7 +1964,7 @@ def read_agent_dictionary(agent_path):
         global subdict
         if line[
                 line.find('!') + 1:].find('!') < 0 or line[line.find('!'):].find('=') < 0:
-            logger.warning(markdeferrorstr + enderrorstr)
+            logger.warning(markdeferrorstr + enderrorstr + lines.where())
             return
         ka = line.find('!') + 1
         marker = line[ka:line.find('!', ka)]
@@ -1713,13 +1981,13 @@ def read_agent_dictionary(agent_path):
             ka = agent.find('!')
             logger.warning("Substitution marker \"" +
                            agent[ka:agent.find(' ', ka) + 1] +
-                           "\" syntax incorrect" + enderrorstr)
+                           "\" syntax incorrect" + enderrorstr + lines.where())
             return
         part = agent.partition('!')
         part2 = part[2].partition('!')
         if part2[0] not in subdict:
             logger.warning("Substitution marker !" + part2[0] +
-                           "! missing in .agents file; line skipped")
+                           "! missing in .agents file; line skipped" + lines.where())
             return
         for subst in subdict[part2[0]]:
             #			print part[0]+subst+part2[2]
@@ -1737,19 +2005,19 @@ def read_agent_dictionary(agent_path):
     # note that this will be ignored if there are no errors
     logger = logging.getLogger('petr_log')
     logger.info("Reading " + PETRglobals.AgentFileName + "\n")
-    open_FIN(agent_path, "agent")
+    lines = read_dictionary_lines(agent_path, "agent")
 
-    line = read_FIN_line()
+    line = next_line(lines)
     while len(line) > 0:  # loop through the file
 
         if '!' in line and '=' in line:  # synonym set
             define_marker(line)
-            line = read_FIN_line()
+            line = next_line(lines)
             continue
 
         if '[' not in line:  # code specified?
-            logger.warning(codeerrorstr + enderrorstr)
-            line = read_FIN_line()
+            logger.warning(codeerrorstr + enderrorstr + lines.where())
+            line = next_line(lines)
             continue
 
         part = line.partition('[')
@@ -1759,8 +2027,8 @@ def read_agent_dictionary(agent_path):
             store_marker(agent, code)  # handle a substitution marker
         elif '{' in part[0]:
             if '}' not in part[0]:
-                logger.warning(brackerrorstr + enderrorstr)
-                line = read_FIN_line()
+                logger.warning(brackerrorstr + enderrorstr + lines.where())
+                line = next_line(lines)
                 continue
             agent = part[0][:part[0].find('{')].strip() + ' '
             # this will automatically set the null case
@@ -1778,9 +2046,7 @@ def read_agent_dictionary(agent_path):
         if len(plural) > 0:
             store_agent(plural + ' ', code)
 
-        line = read_FIN_line()
-
-    close_FIN()
+        line = next_line(lines)
 
 
 def show_AgentDict(filename=''):
@@ -1803,6 +2069,151 @@ def show_AgentDict(filename=''):
 # ==== Input format reading
 
 
+def make_pattern_trie(patlist):
+    """
+    Compiles an ActorDict or AgentDict pattern list into a trie over the words
+    that follow the keyword, so that petrarch.match_pattern_trie() tries all of
+    the patterns in one traversal of the phrase. The edges are keyed on the
+    connector before the word -- '_' if it must follow directly, ' ' if other
+    words may come between -- followed by the word.
+
+    Each node is [best, index, code, children]: best is the lowest index in
+    patlist of a pattern in the subtree of the node, and index and code are
+    those of the first pattern that ends at the node, or None. The final element
+    of a pattern is its terminator, and a pattern whose only element is
+    ('', connector) matches the keyword alone.
+    """
+    root = [len(patlist), None, None, {}]
+    for index, pattern in enumerate(patlist):
+        words = pattern[2:max(3, len(pattern) - 1)]
+        if len(pattern) == 3 and pattern[2][0] == '':
+            words = []
+        node = root
+        node[0] = min(node[0], index)
+        connector = pattern[1]
+        for word, nextconnector in words:
+            key = ('_' if connector == '_' else ' ') + word
+            if key not in node[3]:
+                node[3][key] = [index, None, None, {}]
+            node = node[3][key]
+            node[0] = min(node[0], index)
+            connector = nextconnector
+        if node[1] is None:
+            node[1] = index
+            node[2] = pattern[0]
+    return root
+
+
+def make_pattern_tries(patdict):
+    """ Returns the make_pattern_trie() of each pattern list in patdict. """
+    return dict((word, make_pattern_trie(patlist))
+                for word, patlist in patdict.items())
+
+
+# ================== PARALLEL LOADING ================== #
+
+# the reader of each kind of dictionary file and the globals it fills
+DictionaryReaders = {
+    'verb': (read_verb_dictionary, ('VerbDict',)),
+    'actor': (read_actor_dictionary, ('ActorDict', 'ActorCodes', 'ActorCodeDates')),
+    'agent': (read_agent_dictionary, ('AgentDict',)),
+    'discard': (read_discard_list, ('DiscardList', 'DiscardPhrases',
+                                    'DiscardAutomaton')),
+    'issue': (read_issue_list, ('IssueList', 'IssueCodes', 'IssueAutomaton')),
+}
+
+
+def read_dictionary_file(job):
+    """
+    Reads the dictionary file of job, (kind, path, WriteActorRoot), and returns the
+    DictionaryReaders globals of kind as a dict. The reader fills empty PETRglobals,
+    which are put back as they were afterwards, whether or not it succeeds.
+    """
+    kind, path, writeroot = job
+    reader, names = DictionaryReaders[kind]
+    saved = dict((name, getattr(PETRglobals, name))
+                 for name in names + ('WriteActorRoot',))
+    PETRglobals.WriteActorRoot = writeroot
+    try:
+        for name in names:
+            setattr(PETRglobals, name, type(saved[name])())
+        reader(path)
+        return dict((name, getattr(PETRglobals, name)) for name in names)
+    finally:
+        for name, value in saved.items():
+            setattr(PETRglobals, name, value)
+
+
+def _read_dictionary_file_marshalled(job):
+    # The worker ends once the file is read, so nothing needs collecting, and a
+    # collection would go through all the objects inherited from the parent.
+    # marshal is much faster than the pickling the pool would otherwise do.
+    gc.disable()
+    return marshal.dumps(read_dictionary_file(job))
+
+
+def read_dictionary_files(jobs, processes=1):
+    """
+    Reads the dictionary files of jobs, a list of (kind, path) in the order they
+    are read in, and returns their globals as a dict; PETRglobals are left as they
+    are. Given more than one process, and processors to run them, the files are read by a pool of processes, largest first, and their
+    globals merged [see merge_dictionary_files()], so the time is about that of
+    the largest file.
+    """
+    jobs = [(kind, path, PETRglobals.WriteActorRoot) for kind, path in jobs]
+    processes = min(processes, multiprocessing.cpu_count(), len(jobs))
+    # the workers of a process pool cannot have children of their own
+    if processes < 2 or multiprocessing.current_process().daemon:
+        return merge_dictionary_files([(job[0], read_dictionary_file(job))
+                                       for job in jobs])
+
+    order = sorted(range(len(jobs)), key=lambda k: -os.path.getsize(jobs[k][1]))
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_read_dictionary_file_marshalled,
+                           [jobs[k] for k in order], chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    partials = [None] * len(jobs)
+    gcenabled = gc.isenabled()
+    gc.disable()  # see read_dictionary_snapshot()
+    try:
+        for k, result in zip(order, results):
+            partials[k] = (jobs[k][0], marshal.loads(result))
+    finally:
+        if gcenabled:
+            gc.enable()
+    return merge_dictionary_files(partials)
+
+
+def merge_dictionary_files(partials):
+    """
+    Returns the globals of the read_dictionary_file() results in partials, a list
+    of (kind, globals) in reading order, as one dict. The ActorCodes indexes of
+    each actor file start from zero, so they are shifted by the number of
+    ActorCodes entries of the files before it; the result is the same as reading
+    the files in turn.
+    """
+    merged = {'ActorDict': {}, 'ActorCodes': [], 'ActorCodeDates': []}
+    for kind, partial in partials:
+        if kind != 'actor':
+            merged.update(partial)
+            continue
+        offset = len(merged['ActorCodes'])
+        for keyword, patlist in partial['ActorDict'].items():
+            for pattern in patlist:
+                pattern[0] += offset
+            merged['ActorDict'].setdefault(keyword, []).extend(patlist)
+        merged['ActorCodes'].extend(partial['ActorCodes'])
+        merged['ActorCodeDates'].extend(partial['ActorCodeDates'])
+    return merged
+
+
 def read_xml_input(filepaths, parsed=False):
     """
     Reads input in the PETRARCH XML-input format and creates the global holding
@@ -0,0 +1,394 @@
+##	PETRstore.py [module]
+##
+# Dictionary access for the PETRARCH event coder, and a read-only dictionary store
+# that coding processes share through a memory-mapped file
+##
+# SYSTEM REQUIREMENTS
+# This program has been successfully run under Mac OS 10.10; it is standard Python 2.7
+# so it should also run in Unix or Windows.
+#
+# This project is part of the Open Event Data Alliance tool set
+#
+# This code is covered under the MIT license
+#
+# REVISION HISTORY:
+# Oct-26:	Initial version: actor, agent and actor code store
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import mmap
+import zlib
+import array
+import struct
+import logging
+
+import PETRglobals
+import PETRreader
+import PETRcache
+
+# ================== DICTIONARY ACCESS ================== #
+# The coder looks dictionary entries up through these functions rather than in
+# PETRglobals directly, so the actors, agents and actor codes can come either from
+# the dictionaries read into PETRglobals or from a MappedStore in
+# PETRglobals.DictionaryStore. The verb dictionary is not in the store: every
+# coding process holds its own VerbDict.
+
+# the globals that a MappedStore stands in for; they are left empty while it does
+StoreGlobals = ('ActorDict', 'ActorCodes', 'ActorCodeDates', 'AgentDict',
+                'ActorTries', 'AgentTries')
+
+
+def actor_trie(word):
+    """ Returns the ActorTries trie for word, or None. """
+    if PETRglobals.DictionaryStore is not None:
+        return PETRglobals.DictionaryStore.actors.trie(word)
+    return PETRglobals.ActorTries.get(word)
+
+
+def agent_trie(word):
+    """ Returns the AgentTries trie for word, or None. """
+    if PETRglobals.DictionaryStore is not None:
+        return PETRglobals.DictionaryStore.agents.trie(word)
+    return PETRglobals.AgentTries.get(word)
+
+
+def actor_codes(index):
+    """ Returns the ActorCodes entry index; raises IndexError if there is none. """
+    if PETRglobals.DictionaryStore is not None:
+        return PETRglobals.DictionaryStore.actor_codes(index)
+    return PETRglobals.ActorCodes[index]
+
+
+def actor_dates(index):
+    """
+    Returns the ActorCodeDates entry index; raises IndexError if there is none.
+    """
+    if PETRglobals.DictionaryStore is not None:
+        return PETRglobals.DictionaryStore.actor_dates(index)
+    return PETRglobals.ActorCodeDates[index]
+
+
+def verb_patterns(word):
+    """ Returns the pattern tree of the verb word, or None. """
+    return PETRglobals.VerbDict['verbs'].get(word)
+
+
+def phrase_patterns(meaning):
+    """ Returns the phrase patterns of the verb meaning. """
+    return PETRglobals.VerbDict['phrases'][meaning]
+
+
+def in_synset(word, synset):
+    """ Returns whether word belongs to the verb dictionary synset. """
+    return word in PETRglobals.VerbDict['verbs'][synset]
+
+
+# ================== MAPPED STORE ================== #
+# File layout: StoreMagic, the key line, the section count and a table of
+# (offset, length) pairs, then the sections, each 4-byte aligned. Apart from the
+# UTF-8 string blob, the sections are arrays of 32-bit integers:
+#
+#   strings      offsets of every distinct string in the blob, plus its end
+#   pattern table, once for the actors and once for the agents:
+#     hash       open-addressing table on the CRC-32 of the keyword: entry + 1
+#     keys       string id of the keyword of each entry
+#     starts     first pattern of each entry, plus the end
+#     codes      ActorCodes index (actors) or code string id (agents) per pattern
+#     conns      string id of the connector after the keyword per pattern
+#     tokstarts  first (word, connector) pair of each pattern, plus the end
+#     tokens     string ids of the (word, connector) pairs
+#   actor codes:
+#     starts     first item of each ActorCodes entry, plus the end
+#     items      (kind, date, date, code) per item: kind is PlainCode, ActorRoot
+#                or the type of date restriction
+#     cuts       PETRreader.get_actor_date_cuts() of the ActorCodes
+
+StoreMagic = b'PETRSTORE2\n'
+UINT = struct.Struct(b'=I')
+
+# item kinds for the ActorCodes entries; 0, 1 and 2 are the date restrictions
+PlainCode = -1
+ActorRoot = -2
+
+
+def _uint_array(values):
+    return array.array(b'I', values)
+
+
+class _StoreWriter(object):
+    """ Collects the sections of a store and interns its strings. """
+
+    def __init__(self):
+        self.string_ids = {}
+        self.strings = []
+        self.sections = []
+
+    def intern(self, string):
+        try:
+            return self.string_ids[string]
+        except KeyError:
+            self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+            return self.string_ids[string]
+
+    def add(self, values, typecode=b'I'):
+        self.sections.append(array.array(typecode, values).tostring())
+
+    def add_patterns(self, patdict, string_codes):
+        keys = list(patdict)
+        size = 1
+        while size < 2 * len(keys):
+            size *= 2
+        table = [0] * size
+        for entry, key in enumerate(keys):
+            slot = zlib.crc32(key.encode('utf-8')) & (size - 1)
+            while table[slot]:
+                slot = (slot + 1) & (size - 1)
+            table[slot] = entry + 1
+
+        starts, codes, conns, tokstarts, tokens = [0], [], [], [0], []
+        for key in keys:
+            for pattern in patdict[key]:
+                codes.append(self.intern(pattern[0]) if string_codes
+                             else pattern[0])
+                conns.append(self.intern(pattern[1]))
+                for word, connector in pattern[2:]:
+                    tokens.append(self.intern(word))
+                    tokens.append(self.intern(connector))
+                tokstarts.append(len(tokens) // 2)
+            starts.append(len(codes))
+
+        self.add(table)
+        self.add([self.intern(key) for key in keys])
+        for values in (starts, codes, conns, tokstarts, tokens):
+            self.add(values)
+
+    def add_actor_codes(self, actorcodes):
+        starts, items, cuts = [0], [], set()
+        for codelist in actorcodes:
+            cuts.update(PETRreader.get_restriction_cuts(codelist))
+            for item in codelist:
+                if not isinstance(item, list):
+                    items.extend([ActorRoot, 0, 0, self.intern(item)])
+                elif len(item) == 1:
+                    items.extend([PlainCode, 0, 0, self.intern(item[0])])
+                elif item[0] == 2:
+                    items.extend([2, item[1], item[2], self.intern(item[3])])
+                else:
+                    items.extend([item[0], item[1], 0, self.intern(item[2])])
+            starts.append(len(items) // 4)
+        self.add(starts)
+        self.add(items, b'i')
+        self.add(sorted(cuts))
+
+    def write(self, path, key):
+        blobs = [string.encode('utf-8') for string in self.strings]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        sections = [_uint_array(offsets).tostring(), b''.join(blobs)] + \
+            self.sections
+
+        header = StoreMagic + key.encode('utf-8') + b'\n'
+        start = len(header) + 4 + 8 * len(sections)
+        table = []
+        for section in sections:
+            start += -start % 4
+            table.extend([start, len(section)])
+            start += len(section)
+
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with io.open(temp_path, 'wb') as fout:
+            fout.write(header)
+            fout.write(_uint_array([len(sections)] + table).tostring())
+            position = len(header) + 4 + 8 * len(sections)
+            for offset, section in zip(table[::2], sections):
+                fout.write(b'\0' * (offset - position))
+                fout.write(section)
+                position = offset + len(section)
+        os.rename(temp_path, path)
+
+
+def get_store_key(snapshot_key):
+    """ Returns the key of a store built from the dictionaries of snapshot_key. """
+    return '{} {}'.format(sys.byteorder, snapshot_key)
+
+
+def write_store(path, key, dictionaries):
+    """
+    Writes the ActorDict, AgentDict and ActorCodes of dictionaries, a dict of the
+    PETRglobals dictionaries, to a store at path, headed by key. The file is written
+    under a temporary name and renamed.
+    """
+    writer = _StoreWriter()
+    writer.add_patterns(dictionaries['ActorDict'], False)
+    writer.add_patterns(dictionaries['AgentDict'], True)
+    writer.add_actor_codes(dictionaries['ActorCodes'])
+    writer.write(path, key)
+
+
+class _MappedPatterns(object):
+    """ Read side of one pattern table of a MappedStore. """
+
+    def __init__(self, store, first, string_codes, cache_size):
+        self.store = store
+        (self.hash, self.keys, self.starts, self.codes, self.conns,
+         self.tokstarts, self.tokens) = store.sections[first:first + 7]
+        self.mask = self.hash[1] // 4 - 1
+        self.string_codes = string_codes
+        # decoding a pattern list and compiling its trie is far slower than a dict
+        # lookup, so the tries of the words that come up are kept
+        self.tries = PETRcache.LRUCache(cache_size)
+
+    def find(self, word):
+        store = self.store
+        encoded = word.encode('utf-8')
+        slot = zlib.crc32(encoded) & self.mask
+        while True:
+            entry = store.uint(self.hash, slot)
+            if not entry:
+                return -1
+            if store.string_bytes(store.uint(self.keys, entry - 1)) == encoded:
+                return entry - 1
+            slot = (slot + 1) & self.mask
+
+    def trie(self, word):
+        trie = self.tries.get(word)
+        if trie is not None:
+            return trie or None
+        entry = self.find(word)
+        trie = PETRreader.make_pattern_trie(self.decode(entry)) if entry >= 0 \
+            else []
+        self.tries.put(word, trie)
+        return trie or None
+
+    def decode(self, entry):
+        store = self.store
+        start, end = store.uints(self.starts, entry, 2)
+        count = end - start
+        codes = store.uints(self.codes, start, count)
+        conns = store.uints(self.conns, start, count)
+        tokstarts = store.uints(self.tokstarts, start, count + 1)
+        tokens = store.uints(self.tokens, 2 * tokstarts[0],
+                             2 * (tokstarts[-1] - tokstarts[0]))
+        string = store.string
+        patlist = []
+        for k in range(count):
+            code = string(codes[k]) if self.string_codes else codes[k]
+            pattern = [code, string(conns[k])]
+            for t in range(tokstarts[k] - tokstarts[0],
+                           tokstarts[k + 1] - tokstarts[0]):
+                pattern.append((string(tokens[2 * t]),
+                                string(tokens[2 * t + 1])))
+            patlist.append(pattern)
+        return patlist
+
+
+class MappedStore(object):
+    """
+    Read-only ActorDict, AgentDict and ActorCodes held in a memory-mapped file
+    written by write_store(). The entries are decoded to the structures the
+    dictionary readers build as they are looked up, so processes that open the
+    same file share a single copy of the dictionaries in the page cache. The
+    make_actor_dates() of the last cache_size actor codes that came up are kept
+    per index, as the tries are for each pattern table, and
+    date_cuts is the PETRreader.get_actor_date_cuts() of all of them. Raises
+    ValueError if the file is not a store with the given key.
+    """
+
+    def __init__(self, path, key, cache_size=4096):
+        with io.open(path, 'rb') as fin:
+            self.map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        header = StoreMagic + key.encode('utf-8') + b'\n'
+        if self.map[:len(header)] != header:
+            self.map.close()
+            raise ValueError('{} is not a dictionary store for {}'.format(path, key))
+        count = UINT.unpack_from(self.map, len(header))[0]
+        table = struct.unpack_from(b'={}I'.format(2 * count), self.map,
+                                   len(header) + 4)
+        self.sections = [table[k:k + 2] for k in range(0, len(table), 2)]
+
+        self.offsets, self.blob = self.sections[:2]
+        self.actors = _MappedPatterns(self, 2, False, cache_size)
+        self.agents = _MappedPatterns(self, 9, True, cache_size)
+        self.code_starts, self.code_items, cuts = self.sections[16:19]
+        self.ncodes = self.code_starts[1] // 4 - 1
+        self.date_cuts = list(self.uints(cuts, 0, cuts[1] // 4))
+        self.dates = PETRcache.LRUCache(cache_size)
+
+    def uint(self, section, index):
+        return UINT.unpack_from(self.map, section[0] + 4 * index)[0]
+
+    def uints(self, section, index, count):
+        return struct.unpack_from(b'={}I'.format(count), self.map,
+                                  section[0] + 4 * index)
+
+    def string_bytes(self, sid):
+        start, end = self.uints(self.offsets, sid, 2)
+        base = self.blob[0]
+        return self.map[base + start:base + end]
+
+    def string(self, sid):
+        return self.string_bytes(sid).decode('utf-8')
+
+    def actor_codes(self, index):
+        if index < 0:
+            index += self.ncodes
+        if not 0 <= index < self.ncodes:
+            raise IndexError('actor code index out of range')
+        start, end = self.uints(self.code_starts, index, 2)
+        items = struct.unpack_from(b'={}i'.format(4 * (end - start)), self.map,
+                                   self.code_items[0] + 16 * start)
+        codelist = []
+        for k in range(0, len(items), 4):
+            kind, first, last, sid = items[k:k + 4]
+            code = self.string(sid)
+            if kind == ActorRoot:
+                codelist.append(code)
+            elif kind == PlainCode:
+                codelist.append([code])
+            elif kind == 2:
+                codelist.append([2, first, last, code])
+            else:
+                codelist.append([kind, first, code])
+        return tuple(codelist)
+
+    def actor_dates(self, index):
+        dates = self.dates.get(index)
+        if dates is None:
+            dates = PETRreader.make_actor_dates(self.actor_codes(index))
+            self.dates.put(index, dates)
+        return dates
+
+    def close(self):
+        self.map.close()
+
+
+def find_store(path, key):
+    """ Returns the MappedStore at path if it was written with key, otherwise None. """
+    try:
+        return MappedStore(path, key)
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+
+def open_store(path, key, dictionaries):
+    """
+    Returns a MappedStore for dictionaries [see write_store()], writing it to path
+    first unless a store with key is already there; None if it cannot be used.
+    """
+    logger = logging.getLogger('petr_log')
+    store = find_store(path, key)
+    if store is not None:
+        return store
+    try:
+        write_store(path, key, dictionaries)
+        return MappedStore(path, key)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        logger.warning('Could not use dictionary store {}: {}'.format(path, e))
+        return None
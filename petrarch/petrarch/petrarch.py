@@ -4,10 +4,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import re
 import sys
 import glob
+import itertools
 import time
 import types
+import bisect
+import hashlib
 import logging
 import argparse
 import xml.etree.ElementTree as ET
@@ -53,6 +57,9 @@ import xml.etree.ElementTree as ET
 import PETRglobals  # global variables
 import PETRreader  # input routines
 import PETRwriter
+import PETRcache
+import PETRmetrics
+import PETRstore
 import utilities
 
 # ================================  DEBUGGING GLOBALS  ==================== #
@@ -81,6 +88,9 @@ ShowMarkCompd = True
 ShowMarkCompd = False
 
 SentenceID = ""
+
+# the brackets of a parse tree, as indexed by read_TreeBank
+BracketPattern = re.compile(r'[()]')
 # ================== EXCEPTIONS ================== #
 
 
@@ -195,6 +205,48 @@ def check_balance(ParseList):
         raise UnbalancedTree
 
 
+def index_phrases(ParseList):
+    """
+    Returns ParseMatch, the list parallel to ParseList that gives the location of the ~XX
+    closing each (XX and of the (XX opening each ~XX; words are -1. A ~XX closes the
+    nearest open (XX, and any tag left without a match, which only occurs in the pieces
+    of a phrase copied by assign_NEcodes(), is also -1.
+    """
+    ParseMatch = [-1] * len(ParseList)
+    opstack = []
+    for ka, item in enumerate(ParseList):
+        if item[0] == '(':
+            opstack.append(ka)
+        elif item[0] == '~':
+            tag = item[1:]
+            kb = len(opstack) - 1
+            while kb >= 0 and ParseList[opstack[kb]][1:] != tag:
+                kb -= 1
+            if kb >= 0:
+                kc = opstack[kb]
+                ParseMatch[kc] = ka
+                ParseMatch[ka] = kc
+                del opstack[kb:]
+    return ParseMatch
+
+
+def splice_phrases(ParseList, ParseMatch, kstart, kend, newlist=()):
+    """
+    Replaces ParseList[kstart:kend], which holds complete phrases, with newlist -- or
+    deletes it -- and keeps ParseMatch in step: newlist is indexed on its own and the
+    matches beyond kend are shifted. Both lists are changed in place.
+    """
+    newmatch = [kb + kstart if kb >= 0 else -1 for kb in index_phrases(newlist)]
+    shift = len(newlist) - (kend - kstart)
+    ParseList[kstart:kend] = newlist
+    ParseMatch[kstart:kend] = newmatch
+    if shift:
+        knew = kstart + len(newlist)
+        for ka in itertools.chain(range(kstart), range(knew, len(ParseMatch))):
+            if ParseMatch[ka] >= kend:
+                ParseMatch[ka] += shift
+
+
 # ========================== VALIDATION FUNCTIONS ========================== #
 
 
@@ -473,45 +525,62 @@ def read_TreeBank(tree_string):
         nplist.append(')')
         return nplist
 
+    def index_brackets(treestr):
+        """
+        Indexes the brackets of treestr in a single pass: returns the sorted offsets of
+        all of the brackets and dicts giving the offset past the matching ')' of each '(',
+        the '(' that encloses each '(' (-1 at the top level) and the '(' closed by each
+        ')'. Unmatched brackets are left out of the dicts.
+        """
+        offsets = []
+        closers = {}
+        parents = {}
+        openers = {}
+        stack = []
+        for match in BracketPattern.finditer(treestr):
+            ka = match.start()
+            offsets.append(ka)
+            if treestr[ka] == '(':
+                parents[ka] = stack[-1] if stack else -1
+                stack.append(ka)
+            elif stack:
+                kb = stack.pop()
+                openers[ka] = kb
+                closers[kb] = ka + 1
+        return offsets, closers, parents, openers
+
     def get_forward_bounds(ka):
         """
         Returns the bounds of a phrase in treestr that begins at ka, including the final space.
         """  # <13.12.07> see note above
-        kb = ka + 1
-        nparen = 1  # paren count
-        while nparen > 0:
-            if kb >= len(treestr):
-                check_irregulars('get_forward_bounds')
-            if treestr[kb] == '(':
-                nparen += 1
-            elif treestr[kb] == ')':
-                nparen -= 1
-            kb += 1
+        kb = brackets[1].get(ka)
+        if kb is None:
+            check_irregulars('get_forward_bounds')
         return [ka, kb]
 
     def get_enclosing_bounds(ka):
         """
         Returns the bounds of a phrase in treestr that encloses the phrase beginning at ka
         """
-        kstart = ka - 1
-        nparen = 0  # paren count
-        while nparen <= 0:  # back out to the phrase tag that encloses this
-            if kstart < 0:
-                check_irregulars('get_enclosing_bounds')
-            if treestr[kstart] == '(':
-                nparen += 1
-            elif treestr[kstart] == ')':
-                nparen -= 1
-            kstart -= 1
-        return [kstart + 1, get_forward_bounds(kstart + 1)[1]]
-
-    def resolve_compounds(ka, fline):
+        offsets, closers, parents, openers = brackets
+        kb = bisect.bisect_left(offsets, ka) - 1  # last bracket before ka
+        if kb < 0:
+            kstart = -1
+        elif treestr[offsets[kb]] == '(':
+            kstart = offsets[kb]
+        else:  # back out past the phrase that this ')' closes
+            kstart = parents.get(openers.get(offsets[kb]), -1)
+        if kstart < 0:
+            check_irregulars('get_enclosing_bounds')
+        return [kstart, get_forward_bounds(kstart)[1]]
+
+    def resolve_compounds(ka, fullline):
         """
         Assign indices, eliminates the internal commas and (CC, and duplicate
         any initial adjectives inside a compound.
 
-        This leaves the (NEC with leaving just the (NE.
-        Returns treestr loc (ka) past the end of the phrase.
+        This leaves the (NEC with leaving just the (NE; the phrase is appended
+        to the fullline list. Returns treestr loc (ka) past the end of the phrase.
         Index assignment may involve just a simple (NNP or (NNS.
 
             Parsing bug note: <14.01.13>
@@ -534,8 +603,6 @@ def read_TreeBank(tree_string):
             appears to occur only very rarely -- and in any case is a parsing
             error -- so this routine does not check for it.
         """
-        fullline = fline
-
         necbds = get_forward_bounds(ka)  # get the bounds of the NEC phrase
         if ShowMarkCompd:
             print('rc/RTB: NEC:', necbds, treestr[necbds[0]:necbds[1]])
@@ -571,14 +638,13 @@ def read_TreeBank(tree_string):
 
                 if ShowMarkCompd:
                     print('rc/RTB-2: NE:', nplist)
-                for kb in range(len(nplist)):
-                    fullline += nplist[kb] + ' '
+                fullline.extend(item + ' ' for item in nplist)
                 ka = npbds[1]
             ka += 1
-        fullline += ' ) '  # closes the nec
+        fullline.append(' ) ')  # closes the nec
         if ShowMarkCompd:
-            print('rc/RTB3: NE:', fullline)
-        return necbds[1] + 1, fullline
+            print('rc/RTB3: NE:', ''.join(fullline))
+        return necbds[1] + 1
 
     def process_preposition(ka):
         """
@@ -630,14 +696,14 @@ def read_TreeBank(tree_string):
                                                         # skip the (NP and pick up the final ' ' (we're using this to close
                                                         # the original (NP
             nepph += treestr[npbds[0] + 4:npbds[1] - 1]
-        if '(SBR' in treestr[npbds[1]:]:                # transfer the phrase
-            kc = treestr.find('(SBR', npbds[1])
+        kc = treestr.find('(SBR', npbds[1])
+        if kc >= 0:                                     # transfer the phrase
             nepph += treestr[kc:treestr.find(') ', kc) + 2]
         nepph += ')'                                    # close the phrase
         return nepph
 
     logger = logging.getLogger('petr_log')
-    fullline = ''
+    fullline = []  # pieces of the marked-up tree, joined once at the end
     vpindex = 1
     npindex = 1
     ncindex = 1
@@ -652,36 +718,50 @@ def read_TreeBank(tree_string):
     if '~' in treestr:
         treestr = treestr.replace('~', '-TILDA-')
 
+    brackets = index_brackets(treestr)
+
     ##############################
     # Mark Compounds#
     ##############################
+    # None of the edits adds or removes a bracket or changes the tests on the
+    # phrases that follow, so they are collected against the original offsets
+    # and applied in a single pass
+    edits = {}  # offset: (characters replaced, replacement)
     ka = -1
     while ka < len(treestr):
         ka = treestr.find('(CC', ka + 3)  #
         if ka < 0:
             break
-        kc = treestr.find(')', ka + 3)
         bds = get_enclosing_bounds(ka)
         kb = bds[0]
         if ShowMarkCompd:
             print('\nMC1:', treestr[kb:])
-        if '(VP' in treestr[bds[0]:bds[1]] or '(S' in treestr[bds[0]:bds[1]]:
-            treestr = treestr[:ka + 3] + 'P' + treestr[ka + 3:]
+        if treestr.find('(VP', bds[0], bds[1]) >= 0 or treestr.find('(S', bds[0], bds[1]) >= 0:
+            edits[ka + 3] = (0, 'P')
             if ShowMarkCompd:
-                print('\nMC2:', treestr[kb:])
-        elif treestr[bds[0]:bds[1]].count('(CC') > 1:
+                print('\nMC2:', treestr[kb:ka + 3] + 'P')
+        elif treestr.count('(CC', bds[0], bds[1]) > 1:
             # convert CC to CCP: see note above
-            treestr = treestr[:ka + 4] + 'P' + treestr[ka + 4:]
+            edits[ka + 4] = (0, 'P')
             if ShowMarkCompd:
-                print('\nMC3:', treestr[kb:])
+                print('\nMC3:', treestr[kb:ka + 4] + 'P')
         elif treestr[kb + 1:kb + 3] == 'NP':
             # make sure we actually have multiple nouns in the phrase
             if treestr.count('(N', bds[0], bds[1]) >= 3:
-                treestr = treestr[:kb + 2] + 'EC' + \
-                    treestr[kb + 3:]  # convert NP to NEC
+                edits[kb + 2] = (1, 'EC')  # convert NP to NEC
                 if ShowMarkCompd:
-                    print('\nMC4:', treestr[kb:])
-    
+                    print('\nMC4:', treestr[kb:kb + 2] + 'EC')
+
+    if edits:
+        pieces = []
+        kb = 0
+        for ka in sorted(edits):
+            pieces.extend([treestr[kb:ka], edits[ka][1]])
+            kb = ka + edits[ka][0]
+        pieces.append(treestr[kb:])
+        treestr = ''.join(pieces)
+        brackets = index_brackets(treestr)
+
     if ShowRTTrees:
         print('RT1.5 count:', treestr.count('('), treestr.count(')'))
 
@@ -719,12 +799,13 @@ def read_TreeBank(tree_string):
                 #########################
 
                 # recompute the bounds because treestr has been modified
+                brackets = index_brackets(treestr)
                 npbds = get_forward_bounds(ka)
                 ksb = treestr.find('(SBAR ', npbds[0], npbds[1])
             nephrase = ''
             if ShowNEParsing:
                 print('BBD: ', treestr[npbds[0]:npbds[1]])
-            if '(POS' in treestr[ka + 3:npbds[1]]:  # get the (NP possessive
+            if treestr.find('(POS', ka + 3, npbds[1]) >= 0:  # get the (NP possessive
                 kb = treestr.find('(POS', ka + 4)
                 nephrase = treestr[ka + 4:kb - 1]  # get string prior to (POS
                 if treestr[kb + 12] == 's':
@@ -736,7 +817,7 @@ def read_TreeBank(tree_string):
                 if ShowNEParsing:
                     print('RTPOS: NE:', nephrase)
 
-            elif '(PP' in treestr[ka + 3:npbds[1]]:  # prepositional phrase
+            elif treestr.find('(PP', ka + 3, npbds[1]) >= 0:  # prepositional phrase
                 if False:
                     print('PPP-1: ', treestr[ka:npbds[1]])
                     print(
@@ -760,7 +841,7 @@ def read_TreeBank(tree_string):
                     print('RTPREP: NE:', nephrase)
 
             # no further (NPs, so convert to NE
-            elif '(NP' not in treestr[ka + 3:npbds[1]] and '(NEC' not in treestr[ka + 3:npbds[1]]:
+            elif treestr.find('(NP', ka + 3, npbds[1]) < 0 and treestr.find('(NEC', ka + 3, npbds[1]) < 0:
                 nephrase = treestr[ka:npbds[1]]
                 if ShowNEParsing:
                     print('RTNP: NE:', nephrase)
@@ -773,29 +854,31 @@ def read_TreeBank(tree_string):
 
                 if not nplist:
                     check_irregulars('empty_nplist')
-                for kb in range(len(nplist)):
-                    fullline += nplist[kb] + ' '
+                fullline.extend(item + ' ' for item in nplist)
                 ka = npbds[1] + 1
             else:  # it's something else...
-                fullline += '(NP' + str(npindex) + ' '  # add index
+                fullline.append('(NP' + str(npindex) + ' ')  # add index
                 npindex += 1
                 ka += 4
 
         elif treestr.startswith('(NEC ', ka):
-            fullline += '(NEC' + str(ncindex) + ' '
+            fullline.append('(NEC' + str(ncindex) + ' ')
             ncindex += 1
-            ka, fullline = resolve_compounds(ka, fullline)
+            ka = resolve_compounds(ka, fullline)
 
         elif treestr.startswith('(VP ', ka):  # assign index to VP
-            fullline += '(VP' + str(vpindex) + ' '
+            fullline.append('(VP' + str(vpindex) + ' ')
             vpindex += 1
             ka += 4
-        else:
-            fullline += treestr[ka]
-            ka += 1
+        else:  # copy through to the next phrase tag
+            kb = treestr.find('(', ka + 1)
+            if kb < 0:
+                kb = len(treestr)
+            fullline.append(treestr[ka:kb])
+            ka = kb
 
     # convert the text to ParseList format; convert ')' to ~XX tags
-    ParseList = fullline.split()
+    ParseList = ''.join(fullline).split()
     kopen = 0
     kclose = 0
     for item in ParseList:
@@ -850,28 +933,18 @@ def get_loccodes(thisloc, CodedEvents, UpperSeq, LowerSeq):
     software to extend the dictionaries.
     """
 
-    def get_ne_text(neloc, isupperseq):
-        """ Returns the text of the phrase from UpperSeq/LowerSeq starting at neloc. """
+    def get_ne_text(neitem, isupperseq):
+        """ Returns the text of the phrase of neitem in UpperSeq/LowerSeq. """
         if isupperseq:
-            acphr = UpperSeq[neloc - 1]
-            ka = neloc - 2  # UpperSeq is stored in reverse order
-            # we can get an unbalanced sequence when multi-word verbs cut into
-            # the noun phrase: see DEMO-30 in unit-tests
-            while ka >= 0 and UpperSeq[ka][0] != '~':
-                acphr += ' ' + UpperSeq[ka]
-                ka -= 1
+            # UpperSeq is stored in reverse order; we can get an unbalanced sequence
+            # when multi-word verbs cut into the noun phrase: see DEMO-30 in unit-tests
+            return ' '.join(reversed(UpperSeq[neitem.start:neitem.end]))
         else:
-            acphr = LowerSeq[neloc + 1]
-            ka = neloc + 2
-            while LowerSeq[ka][0] != '~':
-                acphr += ' ' + LowerSeq[ka]
-                ka += 1
+            return ' '.join(LowerSeq[neitem.start:neitem.end])
 
-        return acphr
-
-    def add_code(neloc, isupperseq, cl):
+    def add_code(neitem, isupperseq, cl):
         """
-        Appends the code or phrase from UpperSeq/LowerSeq starting at neloc.
+        Appends the code or phrase of the NEItem neitem from UpperSeq/LowerSeq.
         isupperseq determines the choice of sequence
 
         If PETRglobals.WriteActorText is True, root phrase is added to the code following the
@@ -879,16 +952,11 @@ def get_loccodes(thisloc, CodedEvents, UpperSeq, LowerSeq):
         """
         codelist = cl
 
-        if isupperseq:
-            # "add_code neitem"; nothing to do with acne...
-            acneitem = UpperSeq[neloc]
-        else:
-            acneitem = LowerSeq[neloc]
-        accode = acneitem[acneitem.find('>') + 1:]
+        accode = neitem.code
         if accode != '---':
             codelist.append(accode)
         elif PETRglobals.NewActorLength > 0:  # get the phrase
-            acphr = '"' + get_ne_text(neloc, isupperseq) + '"'
+            acphr = '"' + get_ne_text(neitem, isupperseq) + '"'
             if acphr.count(' ') < PETRglobals.NewActorLength:
                 codelist.append(acphr)
             else:
@@ -898,7 +966,7 @@ def get_loccodes(thisloc, CodedEvents, UpperSeq, LowerSeq):
 
         if PETRglobals.WriteActorText and len(codelist) > 0:
             codelist[-1] += PETRglobals.TextPrimer + \
-                get_ne_text(neloc, isupperseq)
+                get_ne_text(neitem, isupperseq)
 
         return codelist
 
@@ -913,17 +981,19 @@ def get_loccodes(thisloc, CodedEvents, UpperSeq, LowerSeq):
                 'Initial index error on UpperSeq in get_loccodes()')
 
         # extract the compound codes from the (NEC ... ~NEC sequence
-        if '(NEC' in neitem:
+        if '(NEC' == neitem:
             ka = thisloc[0] - 1  # UpperSeq is stored in reverse order
-            while '~NEC' not in UpperSeq[ka]:
-                if '(NE' in UpperSeq[ka]:
-                    codelist = add_code(ka, True, codelist)
+            while '~NEC' != UpperSeq[ka]:
+                if isinstance(UpperSeq[ka], NEItem):
+                    codelist = add_code(UpperSeq[ka], True, codelist)
+                elif '(NEC' == UpperSeq[ka]:  # nested: rejected in make_events()
+                    codelist.append(UpperSeq[ka])
                 ka -= 1
                 if ka < 0:
                     raise_ParseList_error(
                         'Bounds underflow on UpperSeq in get_loccodes()')
         else:
-            codelist = add_code(thisloc[0], True, codelist)  # simple code
+            codelist = add_code(neitem, True, codelist)  # simple code
     else:
 
         try:
@@ -931,18 +1001,20 @@ def get_loccodes(thisloc, CodedEvents, UpperSeq, LowerSeq):
         except IndexError:
             raise_ParseList_error(
                 'Initial index error on LowerSeq in get_loccodes()')
-        if '(NEC' in neitem:  # extract the compound codes
+        if '(NEC' == neitem:  # extract the compound codes
             ka = thisloc[0] + 1
-            while '~NEC' not in LowerSeq[ka]:
-                if '(NE' in LowerSeq[ka]:
-                    add_code(ka, False, codelist)
+            while '~NEC' != LowerSeq[ka]:
+                if isinstance(LowerSeq[ka], NEItem):
+                    add_code(LowerSeq[ka], False, codelist)
+                elif '(NEC' == LowerSeq[ka]:  # nested: rejected in make_events()
+                    codelist.append(LowerSeq[ka])
 
                 ka += 1
                 if ka >= len(LowerSeq):
                     raise_ParseList_error(
                         'Bounds overflow on LowerSeq in get_loccodes()')
         else:
-            codelist = add_code(thisloc[0], False, codelist)  # simple code
+            codelist = add_code(neitem, False, codelist)  # simple code
     if len(codelist) == 0:  # this can occur if all codes in an (NEC are null
         codelist = ['---']
 
@@ -955,24 +1027,28 @@ def find_source(UpperSeq, LowerSeq, Src, Trg):
     neither found then first (NE with --- code Note that we are going through
     the sentence in normal order, so we go through UpperSeq in reverse order.
     Also note that this matches either (NE and (NEC: these are processed
-    differently in make_event_string()
+    differently in make_event_string(). A coded (NE is skipped if its code ends
+    with the code of the target, which is read from LowerSeq[Trg[0]]; this raises
+    an error if that is not a coded (NE.
     """
     SourceLoc = Src
-    kseq = 0
-    while kseq < len(UpperSeq):
-        if ('(NEC' in UpperSeq[kseq]) and not UpperSeq[kseq].endswith(LowerSeq[Trg[0]].split('>')[1]):
+    actors = [kseq for kseq in range(len(UpperSeq))
+              if '(NEC' == UpperSeq[kseq] or isinstance(UpperSeq[kseq], NEItem)]
+    if not actors:
+        return SourceLoc
+    trgcode = LowerSeq[Trg[0]].code
+    for kseq in actors:
+        if '(NEC' == UpperSeq[kseq]:
             SourceLoc = [kseq, True]
             return SourceLoc
-        if ('(NE' in UpperSeq[kseq]) and ('>---' not in UpperSeq[kseq]) and not UpperSeq[kseq].endswith(LowerSeq[Trg[0]].split('>')[1]):
+        code = UpperSeq[kseq].code
+        if not code.startswith('---') and not code.endswith(trgcode):
             SourceLoc = [kseq, True]
             return SourceLoc
-        kseq += 1
-    kseq = 0
-    while kseq < len(UpperSeq):
-        if ('(NE' in UpperSeq[kseq]) and not UpperSeq[kseq].endswith(LowerSeq[Trg[0]].split('>')[1]):
+    for kseq in actors:
+        if not UpperSeq[kseq].code.endswith(trgcode):
             SourceLoc = [kseq, True]
             return SourceLoc
-        kseq += 1
     return SourceLoc
 
 
@@ -993,45 +1069,77 @@ def find_target(LowerSeq, TargetLoc):
     # Look in the lower phrase after the verb
     k = 0
     for item in LowerSeq:
-        if item.startswith('(NEC'):
+        if '(NEC' == item:
             return [k, False]
-        if item.startswith('(NE') and not item.endswith('>---'):
+        if isinstance(item, NEItem) and item.code != '---':
             return [k, False]
         k += 1
 
     k = 0
     for item in LowerSeq:
-        if item.startswith('(NE'):
+        if isinstance(item, NEItem):
             return [k, False]
         k += 1
 
     return TargetLoc
 
 
-def get_upper_seq(kword, ParseList, ParseStart):
+class NEItem(object):
+    """
+    An (NE in an upper or lower sequence: loc is the location of the (NE in ParseList,
+    code its code and sequence[start:end] the words of the phrase. The sequences hold
+    the words and the (NEC, ~NEC and ~NE markers as strings; the index of an (NEC is
+    dropped.
+    """
+    __slots__ = ('loc', 'code', 'start', 'end')
+
+    def __init__(self, loc, code, start, end=None):
+        self.loc = loc
+        self.code = code
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return '(NE<{}>{}'.format(self.loc, self.code)
+
+
+def get_upper_seq(kword, ParseList, ParseStart, Compounds):
     """
     Generate the upper sequence starting from kword; Upper sequence currently
-    terminated by ParseStart, ~S or ~,
+    terminated by ParseStart, ~S or ~, An (NE in Compounds contributes the items of
+    its expansion.
     """
     UpperSeq = []
+    kclose = [0]  # location following the last ~NE or ~NEC in UpperSeq
+
+    def add_item(item, kloc):
+        """ Adds item to UpperSeq; returns False if it ends the sequence. """
+        if ('~,' in item):
+            return False
+        if ('(NE' == item):
+            code = UpperSeq.pop()  # remove the code
+            UpperSeq.append(NEItem(kloc, code, kclose[0], len(UpperSeq)))  # <pas 13.07.26> See Note-1
+        elif (item[0] != '(') and (item[0] != '~'):
+            UpperSeq.append(item)
+        elif ('NEC' in item) or ('~NE' in item):
+            UpperSeq.append(item[:4])  # drop the index of an (NEC
+            if item[0] == '~':
+                kclose[0] = len(UpperSeq)
+        return True
+
     while kword >= ParseStart:
         # print(kword,UpperSeq)
-        if ('~,' in ParseList[kword]):
+        compound = Compounds.get(kword)
+        if compound is not None and compound.end == kword:
+            items = compound.items
+            ka = len(items) - 1
+            while ka >= 0 and add_item(items[ka], compound.start + ka):
+                ka -= 1
+            if ka >= 0:
+                break
+            kword = compound.start
+        elif not add_item(ParseList[kword], kword):
             break
-        if ('(NE' == ParseList[kword]):
-            code = UpperSeq.pop()  # remove the code
-            UpperSeq.append(
-                ParseList[kword] +
-                '<' +
-                str(kword) +
-                '>' +
-                code)  # <pas 13.07.26> See Note-1
-        elif ('NEC' in ParseList[kword]):
-            UpperSeq.append(ParseList[kword])
-        elif ('~NE' in ParseList[kword]):
-            UpperSeq.append(ParseList[kword])
-        elif (ParseList[kword][0] != '(') and (ParseList[kword][0] != '~'):
-            UpperSeq.append(ParseList[kword])
         kword -= 1
         if kword < 0:
             # error is handled in check_verbs
@@ -1044,32 +1152,43 @@ def get_upper_seq(kword, ParseList, ParseStart):
     return UpperSeq
 
 
-def get_lower_seq(kword, endtag, ParseList):
+def get_lower_seq(kword, endtag, ParseList, Compounds):
     """
     Generate the lower sequence starting from kword; lower sequence includes only
-    words in the VP
+    words in the VP. An (NE in Compounds contributes the items of its expansion.
     """
 
     LowerSeq = []
+    opened = []  # the NEItems in LowerSeq still waiting for their ~NE or ~NEC
+
+    def add_item(items, ka, kloc):
+        """ Adds items[ka] to LowerSeq; returns the location of the next item. """
+        if ('(NE' == items[ka]):
+            neitem = NEItem(kloc, items[ka + 1], len(LowerSeq) + 1)
+            LowerSeq.append(neitem)  # <pas 13.07.26> See Note-1
+            opened.append(neitem)
+            ka += 1  # skip code
+        elif (items[ka][0] != '(') and (items[ka][0] != '~'):
+            LowerSeq.append(items[ka])
+        elif ('NEC' in items[ka]) or ('~NE' in items[ka]):
+            if items[ka][0] == '~':
+                for neitem in opened:
+                    neitem.end = len(LowerSeq)
+                del opened[:]
+            LowerSeq.append(items[ka][:4])  # drop the index of an (NEC
+        return ka + 1
+
     # limit this to the verb phrase itself
     while (endtag not in ParseList[kword]):
-        if ('(NE' == ParseList[kword]):
-            LowerSeq.append(
-                ParseList[kword] +
-                '<' +
-                str(kword) +
-                '>' +
-                ParseList[
-                    kword +
-                    1])  # <pas 13.07.26> See Note-1
-            kword += 1  # skip code
-        elif ('NEC' in ParseList[kword]):
-            LowerSeq.append(ParseList[kword])
-        elif ('~NE' in ParseList[kword]):
-            LowerSeq.append(ParseList[kword])
-        elif (ParseList[kword][0] != '(') and (ParseList[kword][0] != '~'):
-            LowerSeq.append(ParseList[kword])
-        kword += 1
+        compound = Compounds.get(kword)
+        if compound is not None and compound.start == kword:
+            items = compound.items
+            ka = 0
+            while ka < len(items):
+                ka = add_item(items, ka, kword + ka)
+            kword = compound.end + 1
+        else:
+            kword = add_item(ParseList, kword, kword)
         # <14.04.23>: need to just set this to len(ParseList)?
         if kword >= len(ParseList):
             # error is handled in check_verbs
@@ -1081,7 +1200,7 @@ def get_lower_seq(kword, endtag, ParseList):
     return LowerSeq
 
 
-def make_multi_sequences(multilist, verbloc, endtag, ParseList, ParseStart):
+def make_multi_sequences(multilist, verbloc, endtag, ParseList, ParseStart, Compounds):
     """
     Check if the multi-word list in multilist is valid for the verb at ParseList[verbloc],
     then create the upper and lower sequences to be checked by the verb patterns. Lower
@@ -1100,8 +1219,8 @@ def make_multi_sequences(multilist, verbloc, endtag, ParseList, ParseStart):
                 else:
                     return False, "", ""
             kword += 1
-        upper = get_upper_seq(verbloc - 1, ParseList, ParseStart)
-        lower = get_lower_seq(kword, endtag, ParseList)
+        upper = get_upper_seq(verbloc - 1, ParseList, ParseStart, Compounds)
+        lower = get_lower_seq(kword, endtag, ParseList, Compounds)
         return True, upper, lower
     else:
         kword = verbloc - 1
@@ -1113,14 +1232,14 @@ def make_multi_sequences(multilist, verbloc, endtag, ParseList, ParseStart):
                     return False, "", ""
             kword -= 1
 
-        upper = get_upper_seq(kword, ParseList, ParseStart)
-        lower = get_lower_seq(verbloc + 1, endtag, ParseList)
+        upper = get_upper_seq(kword, ParseList, ParseStart, Compounds)
+        lower = get_lower_seq(verbloc + 1, endtag, ParseList, Compounds)
         return True, upper, lower
 
 
 def skip_item(item):
     """ Determines whether a particular item in the parse needs to be skipped """
-    if item[0] in "~(":
+    if isinstance(item, NEItem) or item[0] in "~(":
         return 1
     if item in ["THE", "A", "AN", "IT", "HE", "THEY",
                 "HER", "HAS", "HAD", "HAVE", "SOME", "FEW", "THAT"]:
@@ -1137,11 +1256,13 @@ def skip_item(item):
         return 0
 
 
-def check_verbs(ParseList, ParseStart, CodedEv):
+def check_verbs(ParseList, ParseMatch, Compounds, ParseStart, CodedEv):
     """
     Primary coding loop which looks for verbs, checks whether any of their
     patterns match, then fills in the source and target if there has been a
-    match. Stores events using make_event_strings().
+    match. Stores events using make_event_strings(). ParseMatch is the index of
+    ParseList from index_phrases() and Compounds the expanded (NE phrases from
+    assign_NEcodes().
 
     Note: the "upper" sequence is the part before the verb -- that is, higher
     on the screen -- and the "lower" sequence is the part after the verb.
@@ -1181,9 +1302,8 @@ def check_verbs(ParseList, ParseStart, CodedEv):
         Check whether the verb phrase beginning at kitem is passive; returns
         location of verb if true, zero otherwise.
         """
-        try:
-            cpendtag = ParseList.index('~' + ParseList[kitem][1:])
-        except ValueError:
+        cpendtag = ParseMatch[kitem]
+        if cpendtag < 0:
             raise_CheckVerbs_error(kitem, "check_passive()")
         # no point in looking before + 3 since we need an auxiliary verb
         if '(VBN' in ParseList[kitem + 3:cpendtag]:
@@ -1228,8 +1348,9 @@ def check_verbs(ParseList, ParseStart, CodedEv):
                     "'" +
                     targ +
                     "'",
-                    targ in PETRglobals.VerbDict['verbs'])
-            if targ in PETRglobals.VerbDict['verbs']:
+                    PETRstore.verb_patterns(targ) is not None)
+            patternlist = PETRstore.verb_patterns(targ)
+            if patternlist is not None:
         
                 SourceLoc = ""
                 TargetLoc = ""
@@ -1239,7 +1360,6 @@ def check_verbs(ParseList, ParseStart, CodedEv):
                 endtag = '~' + ParseList[vpstart][1:]
                 hasmatch = False
 
-                patternlist = PETRglobals.VerbDict['verbs'][targ]
                 verbcode = '---'
 
                 # Find verb boundaries, verb code
@@ -1321,10 +1441,10 @@ def check_verbs(ParseList, ParseStart, CodedEv):
                     verbcode = verbdata['code']
                     line = verbdata['line']
 
-                upper = get_upper_seq(verb_start - 1, ParseList, ParseStart)
-                lower = get_lower_seq(verb_end + 1, endtag, ParseList)
+                upper = get_upper_seq(verb_start - 1, ParseList, ParseStart, Compounds)
+                lower = get_lower_seq(verb_end + 1, endtag, ParseList, Compounds)
                 if not meaning == '':
-                    patternlist = PETRglobals.VerbDict['phrases'][meaning]
+                    patternlist = PETRstore.phrase_patterns(meaning)
                 if ShowPattMatch:
                     print("CV-2 patlist",patternlist.keys())
 
@@ -1375,9 +1495,7 @@ def check_verbs(ParseList, ParseStart, CodedEv):
                                 EventCode)
 
                 if hasmatch:
-
-                    while (endtag not in ParseList[kitem]):
-                        kitem += 1  # resume search past the end of VP
+                    kitem = ParseMatch[vpstart]  # resume search past the end of VP
         kitem += 1
     return CodedEvents, SourceLoc
 
@@ -1402,7 +1520,7 @@ def verb_pattern_match(patlist, upper, lower):
 
     def find_actor(phrase, i):
         for j in range(i, len(phrase)):
-            if phrase[j][0] == "(":
+            if isinstance(phrase[j], NEItem) or phrase[j] == '(NEC':
                 return j
         print("NO ACTOR FOUND",phrase,j)
 
@@ -1444,7 +1562,7 @@ def verb_pattern_match(patlist, upper, lower):
                     print("could be a synset")
                 matchflag = False
                 for set in path['synsets'].keys():
-                    if upper[i] in PETRglobals.VerbDict['verbs'][set]:
+                    if PETRstore.in_synset(upper[i], set):
                         if VPMPrint:
                             print("We found a synset match")
                         pathleft.append((path, i, 2))
@@ -1496,7 +1614,7 @@ def verb_pattern_match(patlist, upper, lower):
                 if VPMPrint:
                     print("Matching compound", upper, i)
                 ka = i
-                while '(NEC' not in upper[ka]:
+                while '(NEC' != upper[ka]:
                     ka += 1
                     if ka >= len(upper):
                         option = 6
@@ -1514,9 +1632,9 @@ def verb_pattern_match(patlist, upper, lower):
             if skipcheck > 0:
                 if VPMPrint:
                     print("skipping",i,len(lower))
-                if "~NEC" in upper[i]:
+                if "~NEC" == upper[i]:
                     in_NEC = not in_NEC
-                elif "~NE" in upper[i]:
+                elif "~NE" == upper[i]:
                     in_NE = not in_NE
                 
                 if i < len(lower) -1:
@@ -1600,9 +1718,7 @@ def verb_pattern_match(patlist, upper, lower):
         if VPMPrint:
             print(
                 "checking",
-                "'" +
-                lower[i] +
-                "'",
+                "'{}'".format(lower[i]),
                 option,
                 phrase_actor,
                 in_NE,path.keys())
@@ -1613,13 +1729,14 @@ def verb_pattern_match(patlist, upper, lower):
         if skipcheck > 0 and option > -1:
             if VPMPrint:
                 print("Skipping")
-            if "NEC" in lower[i]:
+            if isinstance(lower[i], NEItem):
+                in_NE = not in_NE
+                phrase_actor = i
+                phrase_actors[i] = i
+            elif "NEC" in lower[i]:
                 in_NEC = not in_NEC
             elif "NE" in lower[i]:
                 in_NE = not in_NE
-                if len(lower[i]) > 3:
-                    phrase_actor = i
-                    phrase_actors[i] = i
             if i < len(lower) -1 :
                 i +=1
                 continue
@@ -1660,7 +1777,7 @@ def verb_pattern_match(patlist, upper, lower):
             if VPMPrint:
                 print("Checking for synset")
             for set in path['synsets'].keys():
-                if lower[i] in PETRglobals.VerbDict['verbs'][set]:
+                if PETRstore.in_synset(lower[i], set):
                     if VPMPrint:
                         print("We found a synset match")
                     pathleft.append((path, i, 2))
@@ -1717,7 +1834,7 @@ def verb_pattern_match(patlist, upper, lower):
                 print("Matching compound", upper, i)
             ka = i
             # print(ka)
-            while '(NEC' not in upper[ka]:
+            while '(NEC' != upper[ka]:
                 # print(upper[ka])
                 ka += 1
                 if ka >= len(upper):
@@ -1725,7 +1842,8 @@ def verb_pattern_match(patlist, upper, lower):
                     break
             if option == 6:
                 continue
-            source = lower[ka][-3:]
+            item = lower[ka]
+            source = (item.code if isinstance(item, NEItem) else item)[-3:]
             target = source
             pathleft.append((path, i, 6))
             path = path['%']
@@ -1782,7 +1900,7 @@ def verb_pattern_match(patlist, upper, lower):
 
         else:
             if VPMPrint:
-                print("no match in lower", pathleft.keys())
+                print("no match in lower", len(pathleft))
             phrase_return = False
             break
 
@@ -1792,115 +1910,69 @@ def verb_pattern_match(patlist, upper, lower):
 
 
 def get_actor_code(index, SentenceOrdDate):
-    """ Get the actor code, resolving date restrictions. """
-    logger = logging.getLogger('petr_log')
+    """
+    Get the actor code, resolving date restrictions. The code is looked up in the
+    intervals that PETRreader.make_actor_dates() compiled for the actor, and kept
+    in PETRglobals.ActorCodeMemo for the other sentences of the date.
+    """
+    memokey = (index, SentenceOrdDate)
+    thecode = PETRglobals.ActorCodeMemo.get(memokey)
+    if thecode is not None:
+        return thecode
 
-    thecode = None
     try:
-        codelist = PETRglobals.ActorCodes[index]
+        cuts, codes = PETRstore.actor_dates(index)
     except IndexError:
-
+        logger = logging.getLogger('petr_log')
         logger.warning(
             '\tError processing actor in get_actor_code. Index: {}'.format(index))
-        thecode = '---'
-    if len(codelist) == 1 and len(codelist[0]) == 1:
-
-        thecode = codelist[0][0]  # no restrictions: the most common case
-    for item in codelist:
-        if len(item) > 1:  # interval date restriction
-            if item[0] == 0 and SentenceOrdDate <= item[1]:
-                thecode = item[2]
-                break
-            if item[0] == 1 and SentenceOrdDate >= item[1]:
-                thecode = item[2]
-                break
-            if item[0] == 2 and SentenceOrdDate >= item[
-                    1] and SentenceOrdDate <= item[2]:
-                thecode = item[3]
-                break
-    # if interval search failed, look for an unrestricted code
-    if not thecode:
-        # assumes even if PETRglobals.WriteActorRoot, the actor name at the end
-        # of the list will have length >1 if
-        for item in codelist:
-            if len(item) == 1:
-                thecode = item[0]
-
-    if not thecode:
-        thecode = '---'
-    elif PETRglobals.WriteActorRoot:
-        thecode += PETRglobals.RootPrimer + codelist[-1]
+        return '---'
+    thecode = codes[bisect.bisect_right(cuts, SentenceOrdDate)]
 
+    if len(PETRglobals.ActorCodeMemo) >= PETRglobals.ActorCodeMemoSize:
+        PETRglobals.ActorCodeMemo.clear()
+    PETRglobals.ActorCodeMemo[memokey] = thecode
     return thecode
 
 
-def actor_phrase_match(patphrase, phrasefrag):
+def match_pattern_trie(trie, phrasefrag):
     """
-    Determines whether the actor pattern patphrase occurs in phrasefrag. Returns True if
-    match is successful. Insha'Allah...
+    Finds the patterns of trie [see PETRreader.make_pattern_trie()] that occur in
+    phrasefrag, whose first word is their keyword. A word after a '_' connector
+    must follow the previous one directly; after ' ', other words may come
+    between. Returns (code, length) of the first of them in the pattern list,
+    length being the number of words of phrasefrag it spans, or None if there is
+    no match.
     """
-    ret = False
-    APMprint = False
-    connector = patphrase[1]
-    kfrag = 1   # already know first word matched
-    kpatword = 2  # skip code and connector
-    if APMprint:
-        # debug
-        print(
-            "APM-1",
-            len(patphrase),
-            patphrase,
-            "\nAPM-2",
-            len(phrasefrag),
-            phrasefrag)
-    if len(patphrase) == 2:
-        if APMprint:
-            print("APM-2.1: singleton match")   # debug
-        return True, 1  # root word is a sufficient match
-    # <14.02.28>: these both do the same thing, except one handles a string of
-    # the form XXX and the other XXX_. This is probably unnecessary. though it
-    # might be...I suppose those are two distinct cases.
-    if len(patphrase) == 3 and patphrase[2][0] == "":
-        if APMprint:
-            print("APM-2.2: singleton match")   # debug
-        return True, 1  # root word is a sufficient match
-    if kfrag >= len(phrasefrag):
-        return False, 0     # end of phrase with more to match
-    while kpatword < len(patphrase):  # iterate over the words in the pattern
-        if APMprint:
-            # debug
-            print(
-                "APM-3",
-                kfrag,
-                kpatword,
-                "\n  APM Check:",
-                kpatword,
-                phrasefrag[kfrag],
-                patphrase[kpatword][0])
-        if phrasefrag[kfrag] == patphrase[kpatword][0]:
-            if APMprint:
-                print("  APM match")  # debug
-            connector = patphrase[kpatword][1]
-            kfrag += 1
-            kpatword += 1
-            # final element is just the terminator
-            if kpatword >= len(patphrase) - 1:
-                return True, kfrag  # complete pattern matched
-        else:
-            if APMprint:
-                print("  APM fail")  # debug
-            if connector == '_':
-                return False, 0  # consecutive match required, so fail
-            else:
-                kfrag += 1  # intervening words are allowed
-        if kfrag >= len(phrasefrag):
-            return False, 0     # end of phrase with more to match
-
-    return (
-
-        # complete pattern matched (I don't think we can ever hit this)
-        True, len(phrasefrag)
-    )
+    found = None
+    best = None
+    stack = [(trie, 1)]
+    while stack:
+        node, kfrag = stack.pop()
+        if best is not None and node[0] >= best:
+            continue  # nothing in here comes before the match already found
+        if node[1] is not None and (best is None or node[1] < best):
+            best = node[1]
+            found = (node[2], kfrag)
+        # the words of the phrase are looked up rather than the edges tried, as
+        # common keywords have hundreds of them
+        children = node[3]
+        if not children:
+            continue
+        if kfrag < len(phrasefrag):  # consecutive match required
+            child = children.get('_' + phrasefrag[kfrag])
+            if child is not None and (best is None or child[0] < best):
+                stack.append((child, kfrag + 1))
+        seen = set()
+        for kword in range(kfrag, len(phrasefrag)):
+            word = phrasefrag[kword]
+            if word in seen:
+                continue  # the first occurrence is used
+            seen.add(word)
+            child = children.get(' ' + word)
+            if child is not None and (best is None or child[0] < best):
+                stack.append((child, kword + 1))
+    return found
 
 
 def check_NEphrase(nephrase, date):
@@ -1935,22 +2007,17 @@ def check_NEphrase(nephrase, date):
         phrasefrag = nephrase[kword:]
         if ShowNEParsing:
             print("CNEPh Actor Check", phrasefrag[0])
-        if phrasefrag[0] in PETRglobals.ActorDict:
+        trie = PETRstore.actor_trie(phrasefrag[0])
+        if trie is not None:
             if ShowNEParsing:
                 print("                Found", phrasefrag[0])
-            patlist = PETRglobals.ActorDict[nephrase[kword]]
-            if ShowNEParsing:
-                 print("CNEPh Mk1:", patlist)
             actor_index = (kword, kword)
-            for index in range(len(patlist)):
-
-                val, phraselen = actor_phrase_match(patlist[index], phrasefrag)
-                if val:
-                    actor_index = (kword, kword + phraselen)
-                    actorcode = get_actor_code(patlist[index][0], date)
-                    if ShowNEParsing:
-                        print("CNEPh Mk2:", actorcode)
-                    break
+            match = match_pattern_trie(trie, phrasefrag)
+            if match:
+                actor_index = (kword, kword + match[1])
+                actorcode = get_actor_code(match[0], date)
+                if ShowNEParsing:
+                    print("CNEPh Mk2:", actorcode)
         if len(actorcode) > 0:
             break
         else:
@@ -1967,18 +2034,14 @@ def check_NEphrase(nephrase, date):
         if ShowNEParsing:
             print("CNEPh Agent Check", phrasefrag[0])
 
-        if phrasefrag[0] in PETRglobals.AgentDict:
+        trie = PETRstore.agent_trie(phrasefrag[0])
+        if trie is not None:
             if ShowNEParsing:
                 print("                Found", phrasefrag[0])
-            patlist = PETRglobals.AgentDict[nephrase[kword]]
-            for index in range(len(patlist)):
-
-                val = actor_phrase_match(patlist[index], phrasefrag)
-
-                if val[0]:
-                    agentlist.append(patlist[index][0])
-                    kword += val[1] - 1
-                    break
+            match = match_pattern_trie(trie, phrasefrag)
+            if match:
+                agentlist.append(match[0])
+                kword += match[1] - 1
         kword += 1   # continue looking for more agents
 
     if len(agentlist) == 0:
@@ -2019,9 +2082,9 @@ def check_NEphrase(nephrase, date):
     return [True, actorcode]
 
 
-def check_commas(plist):
+def check_commas(plist, ParseMatch):
     """
-    Removes comma-delimited clauses from ParseList.
+    Removes comma-delimited clauses from ParseList, keeping its index ParseMatch in step.
 
     Note that the order here is to remove initial, remove terminal, then remove
     intermediate. Initial and terminal remove are done only once; the
@@ -2035,24 +2098,48 @@ def check_commas(plist):
 
     This was a whole lot simpler in TABARI, but TABARI also made some really
     weird matches following comma-clause deletion.
+
+    The deleted phrases are only marked in the mask live while the clauses are
+    found, so the locations below are those of the original ParseList, and
+    ParseList and ParseMatch are compacted once at the end. The steps over a
+    location -- the ka + 2 and so forth of the clause rules -- count only the
+    items that are still live.
     """
     ParseList = plist
+    live = [True] * len(ParseList)
+    # wordcount[ka] is the number of words in ParseList[:ka]
+    wordcount = [0]
+    for item in ParseList:
+        wordcount.append(wordcount[-1] + item[0].isalpha())
+    commas = [ka for ka, item in enumerate(ParseList) if item == '(,']
 
     def count_word(loclow, lochigh):
         """
-        Returns the number of words in ParseList between loclow and lochigh - 1
+        Returns the number of words in ParseList between loclow and lochigh - 1,
+        a range that no deletion has reached
         """
-        cwkt = 0
-        ka = loclow
-        while ka < lochigh:
-            if ParseList[ka] == '(NE':
-                ka += 2  # skip over codes
-            else:
-                if ParseList[ka][0] != '(' and ParseList[ka][
-                        0] != '~' and ParseList[ka][0].isalpha():
-                    cwkt += 1
-                ka += 1
-        return cwkt
+        return max(wordcount[lochigh] - wordcount[loclow], 0)
+
+    def has_words(loclow, lochigh):
+        """
+        Returns True if any live words are in ParseList between loclow and lochigh - 1
+        """
+        return any(live[ka] and ParseList[ka][0].isalpha()
+                   for ka in range(loclow, lochigh))
+
+    def step_live(ka, nstep):
+        """
+        Returns the location of the live item nstep items after ka -- before it if nstep
+        is negative -- or len(ParseList) if the list runs out
+        """
+        incr = 1 if nstep > 0 else -1
+        while nstep != 0:
+            ka += incr
+            if ka >= len(ParseList):
+                return ka
+            if live[ka]:
+                nstep -= incr
+        return ka
 
     def find_end():
         """
@@ -2060,16 +2147,63 @@ def check_commas(plist):
         last element without ~
         """
         ka = len(ParseList) - 1
-        while ka >= 2 and ParseList[ka][0] == '~':
+        while ka >= 2 and (not live[ka] or ParseList[ka][0] == '~'):
             ka -= 1
-        return ka - 1
+        return step_live(ka, -1)
+
+    def find_terminal(kend):
+        """
+        Returns the location of the last live '(, before kend, or of the live item
+        where the reverse search stops
+        """
+        ka = step_live(kend, -1)
+        while ka >= 2 and ParseList[ka] != '(,':
+            ka = step_live(ka, -1)
+        return ka
+
+    def delete_phrase(kstart):
+        """ Marks the phrase beginning at kstart deleted; returns the number of items. """
+        ndel = 0
+        ka = kstart
+        while ka <= ParseMatch[kstart]:
+            if live[ka]:
+                live[ka] = False
+                ndel += 1
+                ka += 1
+            else:  # skip a phrase that was already deleted
+                ka = ParseMatch[ka] + 1
+        return ndel
+
+    def delete_phrases(loclow, lochigh):
+        """
+        Deletes the complete phrases between loclow and lochigh - 1; returns the number
+        of items deleted.
+        """
+        ndel = 0
+        stack = []  # of course we use a stack...this is a tree...
+        ka = lochigh - 1
+        while ka >= loclow:
+            if not live[ka]:
+                pass
+            elif ParseList[ka][0] == '~':
+                stack.append(ParseList[ka][1:])
+            # remove this complete phrase
+            elif len(stack) > 0 and ParseList[ka][0] == '(' and ParseList[ka][1:] == stack[-1]:
+                ndel += delete_phrase(ka)
+                stack.pop()
+            ka -= 1
+        return ndel
+
+    def live_list():
+        """ Returns the items of ParseList that are still live. """
+        return [item for item, keep in zip(ParseList, live) if keep]
 
     logger = logging.getLogger('petr_log')
     # displays trees at various points as ParseList is mangled
     ShowCCtrees = True
     ShowCCtrees = False
 
-    if '(,' not in ParseList:
+    if not commas:
         return ParseList
 
     if ShowCCtrees:
@@ -2083,114 +2217,72 @@ def check_commas(plist):
         why initial clause deletion is turned off by default.
         """
 
-        kount = count_word(2, ParseList.index('(,'))
+        kount = count_word(2, commas[0])
         if kount >= PETRglobals.CommaBMin and kount <= PETRglobals.CommaBMax:
             # leave the comma in place so an internal can catch it
-            loclow = 2
-            lochigh = ParseList.index('(,')
-            ##################
-            # DELETE PHRASES
-            ##################
-            stack = []  # of course we use a stack...this is a tree...
-            ka = lochigh - 1
-            while ka >= loclow:
-                if ParseList[ka][0] == '~':
-                    stack.append(ParseList[ka][1:])
-                # remove this complete phrase
-                elif len(stack) > 0 and ParseList[ka][0] == '(' and ParseList[ka][1:] == stack[-1]:
-                    targ = '~' + ParseList[ka][1:]
-                    ParseList = ParseList[:ka] + \
-                        ParseList[ParseList.index(targ, ka + 1) + 1:]
-                    stack.pop()
-                ka -= 1
-            #################
+            delete_phrases(2, commas[0])
 
         if ShowCCtrees:
-            print('chkcomma-1a-Parselist::', ParseList)
-            show_tree_string(' '.join(ParseList))
+            print('chkcomma-1a-Parselist::', live_list())
+            show_tree_string(' '.join(live_list()))
     if PETRglobals.CommaEMax != 0:  # check for terminal phrase
         kend = find_end()
-        ka = kend - 1  # terminal: reverse search for '('
-        while ka >= 2 and ParseList[ka] != '(,':
-            ka -= 1
+        ka = find_terminal(kend)  # terminal: reverse search for '('
         if ParseList[ka] == '(,':
             kount = count_word(ka, len(ParseList))
             if kount >= PETRglobals.CommaEMin and kount <= PETRglobals.CommaEMax:
                 # leave the comma in place so an internal can catch it
-
-                #################
-                # DELETE PHRASES
-                ###################
-                loclow = ka + 3
-                lochigh = kend
-                stack = []  # of course we use a stack...this is a tree...
-                ka = lochigh - 1
-                while ka >= loclow:
-                    if ParseList[ka][0] == '~':
-                        stack.append(ParseList[ka][1:])
-                    # remove this complete phrase
-                    elif len(stack) > 0 and ParseList[ka][0] == '(' and ParseList[ka][1:] == stack[-1]:
-                        targ = '~' + ParseList[ka][1:]
-                        ParseList = ParseList[:ka] + \
-                            ParseList[ParseList.index(targ, ka + 1) + 1:]
-                        stack.pop()
-                    ka -= 1
-                ####################
-
-
+                delete_phrases(step_live(ka, 3), kend)
 
         if ShowCCtrees:
             print('chkcomma-2a-Parselist::')
-            show_tree_string(' '.join(ParseList))
+            show_tree_string(' '.join(live_list()))
             print("cc-2t:", kount)
     if PETRglobals.CommaMax != 0:
-        ka = ParseList.index('(,')
+        kc = 0
+        while not live[commas[kc]]:
+            kc += 1
+        ka = commas[kc]
         while True:
-            try:
-                kb = ParseList.index('(,', ka + 1)
-            except ValueError:
+            while kc < len(commas) and (commas[kc] <= ka or not live[commas[kc]]):
+                kc += 1
+            if kc == len(commas):
                 break
-            kount = count_word(ka + 2, kb)  # ka+2 skips over , ~,
+            kb = commas[kc]
+            kount = count_word(step_live(ka, 2), kb)  # ka+2 skips over , ~,
+            ndel = 0
             if kount >= PETRglobals.CommaMin and kount <= PETRglobals.CommaMax:
+                ndel = delete_phrases(ka, kb)
 
-                #################
-                # DELETE PHRASES
-                #################
-                loclow = ka
-                lochigh = kb
-                stack = []  # of course we use a stack...this is a tree...
-                ka = lochigh - 1
-                while ka >= loclow:
-                    if ParseList[ka][0] == '~':
-                        stack.append(ParseList[ka][1:])
-                        # remove this complete phrase
-                    elif len(stack) > 0 and ParseList[ka][0] == '(' and ParseList[ka][1:] == stack[-1]:
-                        targ = '~' + ParseList[ka][1:]
-                        ParseList = ParseList[:ka] + \
-                            ParseList[ParseList.index(targ, ka + 1) + 1:]
-                        stack.pop()
-                    ka -= 1
-                ###############
-
-            ka = kb
+            # the search resumes at the location kb had before the deletion
+            ka = step_live(kb, ndel)
 
         if ShowCCtrees:
             print('chkcomma-3a-Parselist::')
-            show_tree_string(' '.join(ParseList))
+            show_tree_string(' '.join(live_list()))
 
     # check for dangling initial or terminal (, , ~,
 
-    ka = ParseList.index('(,')   # initial
-    if count_word(2, ka) == 0:
-        ParseList = ParseList[:ka] + ParseList[ka + 3:]
+    ka = [kb for kb in commas if live[kb]][0]   # initial
+    if not has_words(2, ka):
+        delete_phrase(ka)
 
     kend = find_end()
-    ka = kend - 1  # terminal: reverse search for '(,'
-    while ka >= 2 and ParseList[ka] != '(,':
-        ka -= 1
+    ka = find_terminal(kend)  # terminal: reverse search for '(,'
     if ParseList[ka] == '(,':
-        if count_word(ka + 1, kend) == 0:
-            ParseList = ParseList[:ka] + ParseList[ka + 3:]
+        if not has_words(ka + 1, kend):
+            delete_phrase(ka)
+
+    if not all(live):  # compact both lists
+        newloc = [-1] * len(ParseList)
+        kb = 0
+        for ka in range(len(ParseList)):
+            if live[ka]:
+                newloc[ka] = kb
+                kb += 1
+        ParseMatch[:] = [newloc[kb] if kb >= 0 else -1
+                         for kb, keep in zip(ParseMatch, live) if keep]
+        ParseList[:] = live_list()
 
     if ShowCCtrees:
         print('chkcomma-end-Parselist::')
@@ -2203,12 +2295,31 @@ def check_commas(plist):
     return ParseList
 
 
-def assign_NEcodes(plist, ParseStart, date):
+class CompoundNE(object):
+    """
+    An (NE of ParseList that holds an (NEC: start and end are the locations of its (NE and
+    ~NE, and items is its expansion -- '(NEC', the coded (NE phrases of the compound and
+    '~NEC' -- which the upper and lower sequences read in place of ParseList[start:end + 1].
+    """
+    __slots__ = ('start', 'end', 'items')
+
+    def __init__(self, start, end, items):
+        self.start = start
+        self.end = end
+        self.items = items
+
+
+def assign_NEcodes(plist, ParseMatch, ParseStart, date):
     """
     Assigns non-null codes to NE phrases where appropriate.
+
+    The code of a simple (NE is written into its slot in ParseList. An (NE that holds
+    an (NEC is expanded into a list of NEs in a CompoundNE record instead, so ParseList
+    keeps its length; returns the records in a dict under the locations of both the
+    (NE and the ~NE of the phrase they replace.
     """
 
-    def expand_compound_element(kstart, plist2):
+    def expand_compound_element(kstart, ParseList, ParseMatch):
         """
         An almost but not quite a recursive call on expand_compound_NEPhrase().
         This difference is that the (NEC has already been established so we are just
@@ -2217,12 +2328,12 @@ def assign_NEcodes(plist, ParseStart, date):
         with some possibly too-clever additional code but such constructions are virtually
         unknown in actual news stories.
         """
-        ParseList = plist2
-
+        kend = ParseMatch[kstart]
         try:
-            kend = ParseList.index('~NE', kstart)
             ncstart = ParseList.index('(NEC', kstart, kend)
-            ncend = ParseList.index('~NEC', ncstart, kend)
+            ncend = ParseMatch[ncstart]
+            if not ncstart < ncend < kend:
+                raise ValueError
         except ValueError:
             raise_ParseList_error(
                 'expand_compound_element() in assign_NEcodes')
@@ -2247,21 +2358,21 @@ def assign_NEcodes(plist, ParseStart, date):
                 itemlist.append('~NE')
                 newlist.extend(itemlist)
             ka += 1  # okay to increment since next item is (, or (CC
-        ParseList = ParseList[:kstart] + newlist + ParseList[kend + 1:]
-        return kstart + len(newlist), ParseList
+        splice_phrases(ParseList, ParseMatch, kstart, kend + 1, newlist)
+        return kstart + len(newlist)
 
-    def expand_compound_NEPhrase(kstart, kend, plist1):
+    def expand_compound_NEPhrase(kstart, kend, ParseList, ParseMatch):
         """
-        Expand the compound phrases inside an (NE: this replaces these with a
-        list of NEs with the remaining text simply duplicated. Code and agent
-        resolution will then be done on these phrases as usual. This will
-        handle two separate (NECs, which is as deep as one generally
-        encounters.
+        Expand the compound phrases inside an (NE: this returns a list of NEs, inside an
+        (NEC, with the remaining text simply duplicated. Code and agent resolution will
+        then be done on these phrases as usual. This will handle two separate (NECs,
+        which is as deep as one generally encounters.
         """
-        ParseList = plist1
-
         ncstart = ParseList.index('(NEC', kstart, kend)
-        ncend = ParseList.index('~NEC', ncstart, kend)
+        ncend = ParseMatch[ncstart]
+        if not ncstart < ncend < kend:
+            raise_ParseList_error(
+                'expand_compound_NEPhrase() in assign_NEcodes')
         prelist = ParseList[kstart + 1:ncstart - 1]
         postlist = ParseList[ncend + 1:kend]
         newlist = ['(NEC']
@@ -2282,55 +2393,65 @@ def assign_NEcodes(plist, ParseStart, date):
             ka += 1  # okay to increment since next item is (, or (CC
 
         newlist.append('~NEC')
-        newlist.append('~TLTL')
-        ParseList = ParseList[:kstart] + newlist + ParseList[kend + 1:]
 
         if '(NEC' in newlist[1:-1]:  # expand next set of (NEC if it exists
-            ka = kstart + 1
-            while '(NE' in ParseList[ka:ParseList.index('~TLTL', ka)]:
-                ka, ParseList = expand_compound_element(ka, ParseList)
-        ParseList.remove('~TLTL')  # tell-tale is no longer needed
+            newmatch = index_phrases(newlist)
+            ka = 1
+            while '(NE' in newlist[ka:newmatch[0]]:
+                ka = expand_compound_element(ka, newlist, newmatch)
 
-        return ParseList
+        return newlist
 
-    ParseList = plist
-    kitem = ParseStart
-    while kitem < len(ParseList):
-        if '(NE' == ParseList[kitem]:
-            if ShowNEParsing:
-                print("NE-0:", kitem, ParseList[kitem - 1:])
-            nephrase = []
-            kstart = kitem
-            kcode = kitem + 1
-            kitem += 2  # skip NP, code
-            if kitem >= len(ParseList):
-                raise_ParseList_error(
-                    'Bounds overflow in (NE search in assign_NEcodes')
-
-            while '~NE' != ParseList[kitem]:
-                if ParseList[kitem][1:3] != 'NN':
-                    nephrase.append(ParseList[kitem])
-                kitem += 1
+    def code_phrases(ParseList, ParseMatch, kitem, Compounds):
+        """
+        Codes the NE phrases of ParseList from kitem on. A compound phrase is expanded
+        into a CompoundNE record when Compounds is a dict, and in place otherwise.
+        """
+        while kitem < len(ParseList):
+            if '(NE' == ParseList[kitem]:
+                if ShowNEParsing:
+                    print("NE-0:", kitem, ParseList[kitem - 1:])
+                nephrase = []
+                kstart = kitem
+                kcode = kitem + 1
+                kitem += 2  # skip NP, code
                 if kitem >= len(ParseList):
                     raise_ParseList_error(
-                        'Bounds overflow in ~NE search in assign_NEcodes')
+                        'Bounds overflow in (NE search in assign_NEcodes')
 
-            if ShowNEParsing:
-                print("aNEc", kcode, ":", nephrase)   # debug
+                while '~NE' != ParseList[kitem]:
+                    if ParseList[kitem][1:3] != 'NN':
+                        nephrase.append(ParseList[kitem])
+                    kitem += 1
+                    if kitem >= len(ParseList):
+                        raise_ParseList_error(
+                            'Bounds overflow in ~NE search in assign_NEcodes')
 
-            if '(NEC' in nephrase:
+                if ShowNEParsing:
+                    print("aNEc", kcode, ":", nephrase)   # debug
+
+                if '(NEC' in nephrase:
+                    newlist = expand_compound_NEPhrase(
+                        kstart, kitem, ParseList, ParseMatch)
+                    if Compounds is None:
+                        splice_phrases(ParseList, ParseMatch, kstart, kitem + 1, newlist)
+                        kitem = kstart - 1  # process the (NEs following the expansion
+                    else:
+                        code_phrases(newlist, index_phrases(newlist), 0, None)
+                        Compounds[kstart] = Compounds[kitem] = CompoundNE(
+                            kstart, kitem, newlist)
+                else:
+                    result = check_NEphrase(nephrase, date)
+                    if result[0]:
+                        ParseList[kcode] = result[1]
+                        if ShowNEParsing:
+                            print("Assigned", result[1])   # debug
 
-                ParseList = expand_compound_NEPhrase(kstart, kitem, ParseList)
-                kitem = kstart - 1  # process the (NEs following the expansion
-            else:
-                result = check_NEphrase(nephrase, date)
-                if result[0]:
-                    ParseList[kcode] = result[1]
-                    if ShowNEParsing:
-                        print("Assigned", result[1])   # debug
+            kitem += 1
 
-        kitem += 1
-    return ParseList
+    Compounds = {}
+    code_phrases(plist, ParseMatch, ParseStart, Compounds)
+    return Compounds
 
 
 def make_event_strings(
@@ -2485,29 +2606,26 @@ def check_discards(SentenceText):
        1 : simple match
        2 : story match [+ prefix]
 
-
+    The phrases are found in a single pass of PETRglobals.DiscardAutomaton over
+    the words of the sentence, so overlapping phrases are all seen.
     """
     sent = SentenceText.upper().split()  # case insensitive matching
-    size = len(sent)
-    level = PETRglobals.DiscardList
-    depart_index = [0]
-    discardPhrase = ""
-
-    for i in range(len(sent)):
-
-        if '+' in level:
-            return [2, '+ ' + discardPhrase]
-        elif '$' in level:
-            return [1, ' ' + discardPhrase]
-        elif sent[i] in level:
-            depart_index.append(i)
-            level = level[sent[i]]
-            discardPhrase += " " + sent[i]
-        else:
-            if len(depart_index) == 0:
-                continue
-            i = depart_index[0]
-            level = PETRglobals.DiscardList
+    goto, fail, out = PETRglobals.DiscardAutomaton
+    match = None
+    state = 0
+    for word in sent:
+        while state and word not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(word, 0)
+        for index in out[state]:
+            phrase, kind = PETRglobals.DiscardPhrases[index]
+            if kind == '+':
+                return [2, '+  ' + phrase]
+            if match is None:
+                match = phrase
+
+    if match is not None:
+        return [1, '  ' + match]
     return [0, '']
 
 
@@ -2522,20 +2640,30 @@ def get_issues(SentenceText):
     sent = SentenceText.upper()  # case insensitive matching
     issues = []
 
-    for target in PETRglobals.IssueList:
-        if target[0] in sent:  # found the issue phrase
-            code = PETRglobals.IssueCodes[target[1]]
-            if code[0] == '~':  # ignore code, so bail
-                return []
-            ka = 0
-            gotcode = False
-            while ka < len(issues):
-                if code == issues[ka][0]:
-                    issues[ka][1] += 1
-                    break
-                ka += 1
-            if ka == len(issues):  # didn't find the code, so add it
-                issues.append([code, 1])
+    # one pass of the automaton finds every phrase of IssueList in the sentence
+    goto, fail, out = PETRglobals.IssueAutomaton
+    found = set()
+    state = 0
+    for char in sent:
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        if out[state]:
+            found.update(out[state])
+
+    # each phrase counts once, in IssueList order
+    for index in sorted(found):
+        code = PETRglobals.IssueCodes[PETRglobals.IssueList[index][1]]
+        if code[0] == '~':  # ignore code, so bail
+            return []
+        ka = 0
+        while ka < len(issues):
+            if code == issues[ka][0]:
+                issues[ka][1] += 1
+                break
+            ka += 1
+        if ka == len(issues):  # didn't find the code, so add it
+            issues.append([code, 1])
 
     return issues
 
@@ -2556,22 +2684,29 @@ def code_record(plist1, pstart, date):
 
     logger = logging.getLogger('petr_log')
 
-    try:
-        plist = check_commas(plist)
-    except IndexError:
-        raise_ParseList_error('Index error in check_commas()')
+    # the location of the matching tag of each phrase, shared by the passes below
+    pmatch = index_phrases(plist)
 
-    try:
-        plist = assign_NEcodes(plist, pstart, date)
-    except NameError:
-        print(date)
+    with PETRmetrics.StageSeconds.time('check_commas'):
+        try:
+            plist = check_commas(plist, pmatch)
+        except IndexError:
+            raise_ParseList_error('Index error in check_commas()')
+
+    compounds = {}
+    with PETRmetrics.StageSeconds.time('assign_NEcodes'):
+        try:
+            compounds = assign_NEcodes(plist, pmatch, pstart, date)
+        except NameError:
+            print(date)
     if ShowParseList:
         print('code_rec-Parselist::', plist)
-    try:
-    # this can throw HasParseError which is caught in do_coding
-        CodedEvents, SourceLoc = check_verbs(plist, pstart, CodedEvents)
-    except Exception as e:
-        logger.warning('\tIndexError in parsing, but HasParseError should have caught this. Probably a bad sentence.')
+    with PETRmetrics.StageSeconds.time('check_verbs'):
+        try:
+        # this can throw HasParseError which is caught in do_coding
+            CodedEvents, SourceLoc = check_verbs(plist, pmatch, compounds, pstart, CodedEvents)
+        except Exception as e:
+            logger.warning('\tIndexError in parsing, but HasParseError should have caught this. Probably a bad sentence.')
     
     NEmpty = 0
     if len(CodedEvents) == 0:
@@ -2580,6 +2715,59 @@ def code_record(plist1, pstart, date):
     return CodedEvents, plist, NEmpty
 
 
+def get_coding_options():
+    """ Returns the configuration options that affect the events coded from a parse. """
+    return (PETRglobals.NewActorLength, PETRglobals.RequireDyad,
+            PETRglobals.WriteActorRoot, PETRglobals.WriteActorText,
+            PETRglobals.CommaMin, PETRglobals.CommaMax,
+            PETRglobals.CommaBMin, PETRglobals.CommaBMax,
+            PETRglobals.CommaEMin, PETRglobals.CommaEMax)
+
+
+def code_parse(treestr, date):
+    """
+    Runs read_TreeBank() and code_record() on a formatted parse and returns
+    [coded_events, emptyCount]; coded_events is None if the record could not be
+    coded and IrregularPattern is raised as in read_TreeBank().
+
+    The result depends only on the parse, the dictionaries, the coding options and --
+    through the date restrictions in get_actor_code() -- on where date falls among
+    PETRglobals.ActorDateCuts, so it is cached in PETRglobals.CodingCache under those
+    and duplicate sentences skip the tree processing and pattern matching.
+    """
+    cache = PETRglobals.CodingCache
+    if cache is not None:
+        parsekey = treestr if isinstance(treestr, bytes) else treestr.encode('utf-8')
+        key = (hashlib.sha1(parsekey).hexdigest(), PETRglobals.DictionaryVersion,
+               get_coding_options(),
+               bisect.bisect_right(PETRglobals.ActorDateCuts, date))
+        result = cache.get(key)
+    else:
+        result = None
+
+    if result is None:
+        try:
+            with PETRmetrics.StageSeconds.time('read_TreeBank'):
+                ParseList, ParseStart = read_TreeBank(treestr)
+            try:
+                coded_events, ParseList, emptyCount = code_record(
+                    ParseList, ParseStart, date)
+            except HasParseError:
+                coded_events, emptyCount = None, 0
+            result = [True, coded_events, emptyCount]
+        except IrregularPattern:
+            result = [False]
+        if cache is not None:
+            cache.put(key, result)
+
+    if not result[0]:
+        raise IrregularPattern
+    coded_events = result[1]
+    if coded_events is not None:  # the cached lists must not be handed out
+        coded_events = [list(event) for event in coded_events]
+    return [coded_events, result[2]]
+
+
 def do_coding(event_dict, out_file):
     """
     Main coding loop Note that entering any character other than 'Enter' at the
@@ -2604,12 +2792,30 @@ def do_coding(event_dict, out_file):
     for key, val in event_dict.items():
 
         prev_code = []
+        NStory += 1
 
         SkipStory = False
         logger.info('\n\nProcessing {}'.format(key))
         StoryDate = event_dict[key]['meta']['date']
         StorySource = 'TEMP'
 
+        # a story discard anywhere drops the whole story, so look for one before
+        # any of its sentences is coded
+        discards = {}
+        for sent in val['sents']:
+            if 'parsed' in val['sents'][sent]:
+                disc = check_discards(val['sents'][sent]['content'])
+                if disc[0] == 2:
+                    print("Discard story:", disc[1])
+                    logger.info('\tStory discard. {}'.format(disc[1]))
+                    SkipStory = True
+                    NDiscardStory += 1
+                    break
+                discards[sent] = disc
+        if SkipStory:
+            event_dict[key]['sents'] = None
+            continue
+
         for sent in val['sents']:
             if 'parsed' in event_dict[key]['sents'][sent]:
                 
@@ -2629,36 +2835,25 @@ def do_coding(event_dict, out_file):
                 SentenceSource = 'TEMP'
                 parsed = event_dict[key]['sents'][sent]['parsed']
                 
-                treestr = utilities._format_parsed_str(parsed)
-            
-                disc = check_discards(SentenceText)
+                disc = discards[sent]
 
                 if disc[0] > 0:
-                    if disc[0] == 1:
-                        print("Discard sentence:", disc[1])
-                        logger.info('\tSentence discard. {}'.format(disc[1]))
-                        NDiscardSent += 1
-                        continue
-                    else:
-                        print("Discard story:", disc[1])
-                        logger.info('\tStory discard. {}'.format(disc[1]))
-                        SkipStory = True
-                        NDiscardStory += 1
-                        break
+                    print("Discard sentence:", disc[1])
+                    logger.info('\tSentence discard. {}'.format(disc[1]))
+                    NDiscardSent += 1
+                    continue
 
                 else:
+                    treestr = utilities._format_parsed_str(parsed)
                     try:
-                        ParseList, ParseStart = read_TreeBank(treestr)
+                        coded_events, emptyCount = code_parse(treestr, Date)
                     except IrregularPattern:
                         continue
-                    try:
-                        coded_events, ParseList, emptyCount = code_record(
-                            ParseList, ParseStart, Date)
-                        NEmpty += emptyCount
-                    except HasParseError:
-                        coded_events = None
+                    NEmpty += emptyCount
+                    NSent += 1
                 
                 if coded_events:
+                    NEvents += len(coded_events)
                     event_dict[key]['sents'][sent]['events'] = coded_events
                 if coded_events and PETRglobals.IssueFileName != "":
                     event_issues = get_issues(SentenceText)
@@ -2677,9 +2872,12 @@ def do_coding(event_dict, out_file):
                     '{} has no parse information. Passing.'.format(SentenceID))
                 pass
 
-        if SkipStory:
-            event_dict[key]['sents'] = None
-        
+    PETRmetrics.Stories.inc(NStory)
+    PETRmetrics.Sentences.inc(NSent)
+    PETRmetrics.Events.inc(NEvents)
+    PETRmetrics.EmptySentences.inc(NEmpty)
+    PETRmetrics.Discards.inc(NDiscardSent, 'sentence')
+    PETRmetrics.Discards.inc(NDiscardStory, 'story')
 
     print("Summary:")
     print(
@@ -2748,6 +2946,18 @@ PETRARCH
                                data/text/Gigaword.sample.PETR.xml""",
                                required=False)
 
+    compile_command = sub_parse.add_parser('compile-dicts', help="""Command to
+                                           compile the dictionaries into the
+                                           snapshot named in the config file.""",
+                                           description="""Command to compile
+                                           the dictionaries into the snapshot named
+                                           in the config file, so that later runs
+                                           start without reading them.""")
+    compile_command.add_argument('-c', '--config',
+                                 help="""Filepath for the PETRARCH configuration
+                                 file. Defaults to PETR_config.ini""",
+                                 required=False)
+
     args = aparse.parse_args()
     return args
 
@@ -2802,6 +3012,17 @@ def main():
 
         print("Coding time:", time.time() - start_time)
 
+    elif cli_args.command_name == 'compile-dicts':
+        if cli_args.config:
+            PETRreader.parse_Config(cli_args.config)
+        else:
+            PETRreader.parse_Config(utilities._get_data('data/config/',
+                                                        'PETR_config.ini'))
+        if PETRglobals.SnapshotFileName == "":
+            print('No snapshot_name in the [Dictionaries] section of the config')
+            sys.exit(1)
+        read_dictionaries(rebuild=True)
+
     print("Finished")
 
 
@@ -2811,7 +3032,35 @@ def start_logger():
     utilities.init_logger('PETRARCH.log')
 
 
-def read_dictionaries(validation=False):
+def get_dictionary_paths():
+    """
+    Returns the paths of the dictionary files named in the config: the verbs, the
+    actors, the agents, the discards and, if there is one, the issues.
+    """
+    names = ([PETRglobals.VerbFileName] + PETRglobals.ActorFileList +
+             [PETRglobals.AgentFileName, PETRglobals.DiscardFileName])
+    if PETRglobals.IssueFileName != "":
+        names.append(PETRglobals.IssueFileName)
+    return [utilities._get_data('data/dictionaries', name) for name in names]
+
+
+def read_dictionaries(validation=False, rebuild=False, processes=None):
+    """
+    Reads the dictionaries named in the config into PETRglobals. When the config
+    names a snapshot_name, they are loaded from that snapshot if it was compiled
+    from the same files and options; otherwise, or with rebuild, the dictionary
+    files are read, by processes processes [PETRglobals.LoadProcesses by default],
+    and the snapshot is rewritten.
+
+    When the config names a store_name, the actors and agents are looked up in that
+    PETRstore.MappedStore instead. If the store is already up to date they are not
+    loaded at all -- nor read from their files, unless the snapshot is rewritten;
+    otherwise the store is written from them once they have been read.
+
+    PETRglobals are only replaced once all of the dictionaries have been read, all
+    at once together with the DictionaryVersion and a new CodingCache; if any of
+    them cannot be read, the exception is raised and the ones in use are kept.
+    """
 
     if validation:
         verb_path = utilities._get_data(
@@ -2828,33 +3077,88 @@ def read_dictionaries(validation=False):
             'PETR.Validate.discards.txt')
         return
 
-    print('Verb dictionary:', PETRglobals.VerbFileName)
-    verb_path = utilities._get_data(
-        'data/dictionaries',
-        PETRglobals.VerbFileName)
-
-    PETRreader.read_verb_dictionary(verb_path)
-
-    print('Actor dictionaries:', PETRglobals.ActorFileList)
-    for actdict in PETRglobals.ActorFileList:
-        actor_path = utilities._get_data('data/dictionaries', actdict)
-        PETRreader.read_actor_dictionary(actor_path)
-
-    print('Agent dictionary:', PETRglobals.AgentFileName)
-    agent_path = utilities._get_data('data/dictionaries',
-                                     PETRglobals.AgentFileName)
-    PETRreader.read_agent_dictionary(agent_path)
-
-    print('Discard dictionary:', PETRglobals.DiscardFileName)
-    discard_path = utilities._get_data('data/dictionaries',
-                                       PETRglobals.DiscardFileName)
-    PETRreader.read_discard_list(discard_path)
-
+    dict_paths = get_dictionary_paths()
+    nactors = len(PETRglobals.ActorFileList)
+    verb_path = dict_paths[0]
+    actor_paths = dict_paths[1:1 + nactors]
+    agent_path, discard_path = dict_paths[1 + nactors:3 + nactors]
     if PETRglobals.IssueFileName != "":
-        print('Issues dictionary:', PETRglobals.IssueFileName)
-        issue_path = utilities._get_data('data/dictionaries',
-                                         PETRglobals.IssueFileName)
-        PETRreader.read_issue_list(issue_path)
+        issue_path = dict_paths[3 + nactors]
+
+    version = PETRreader.get_dictionary_version(dict_paths)
+    snapshot_key = PETRreader.get_snapshot_key(version)
+    snapshot_path = ''
+    if PETRglobals.SnapshotFileName != "":
+        snapshot_path = utilities._get_data('data/dictionaries',
+                                            PETRglobals.SnapshotFileName)
+
+    store_path = ''
+    store_key = PETRstore.get_store_key(snapshot_key)
+    store = None
+    if PETRglobals.StoreFileName != "":
+        store_path = utilities._get_data('data/dictionaries',
+                                         PETRglobals.StoreFileName)
+        if not rebuild:
+            store = PETRstore.find_store(store_path, store_key)
+    skip = PETRstore.StoreGlobals if store is not None else ()
+
+    if processes is None:
+        processes = PETRglobals.LoadProcesses
+
+    dictionaries = None
+    if snapshot_path and not rebuild:
+        dictionaries = PETRreader.read_dictionary_snapshot(snapshot_path,
+                                                           snapshot_key, skip)
+    if dictionaries is not None:
+        print('Dictionary snapshot:', PETRglobals.SnapshotFileName)
+    else:
+        # what is not read stays empty
+        dictionaries = {'AgentDict': {}, 'IssueList': [], 'IssueCodes': [],
+                        'IssueAutomaton': PETRreader.make_phrase_automaton([])}
+
+        # a snapshot needs all of the dictionaries, whether or not there is a store
+        readactors = store is None or snapshot_path != ''
+        print('Verb dictionary:', PETRglobals.VerbFileName)
+        jobs = [('verb', verb_path)]
+        if readactors:
+            print('Actor dictionaries:', PETRglobals.ActorFileList)
+            print('Agent dictionary:', PETRglobals.AgentFileName)
+            jobs += ([('actor', actor_path) for actor_path in actor_paths] +
+                     [('agent', agent_path)])
+        print('Discard dictionary:', PETRglobals.DiscardFileName)
+        jobs.append(('discard', discard_path))
+        if PETRglobals.IssueFileName != "":
+            print('Issues dictionary:', PETRglobals.IssueFileName)
+            jobs.append(('issue', issue_path))
+        dictionaries.update(PETRreader.read_dictionary_files(jobs, processes))
+
+        dictionaries['ActorTries'] = PETRreader.make_pattern_tries(
+            dictionaries['ActorDict'])
+        dictionaries['AgentTries'] = PETRreader.make_pattern_tries(
+            dictionaries['AgentDict'])
+
+        if snapshot_path:
+            PETRreader.write_dictionary_snapshot(snapshot_path, snapshot_key,
+                                                 dictionaries)
+
+    if store_path and store is None:
+        store = PETRstore.open_store(store_path, store_key, dictionaries)
+
+    if store is not None:
+        print('Dictionary store:', PETRglobals.StoreFileName)
+        dictionaries.update(ActorDict={}, ActorCodes=[], ActorCodeDates=[],
+                            AgentDict={}, ActorTries={}, AgentTries={})
+        cuts = store.date_cuts
+    else:
+        cuts = PETRreader.get_actor_date_cuts(dictionaries['ActorCodes'])
+
+    # anything cached from the previous dictionaries is no longer valid; a store
+    # that is still in use by coding elsewhere closes once released
+    dictionaries.update(DictionaryVersion=version, DictionaryStore=store,
+                        ActorDateCuts=cuts, ActorCodeMemo={},
+                        CodingCache=PETRcache.LRUCache(PETRglobals.CodingCacheSize))
+    for name, value in dictionaries.items():
+        setattr(PETRglobals, name, value)
 
 
 def run(filepaths, out_file, s_parsed):
@@ -1,4 +1,7 @@
-from petrarch import petrarch, PETRglobals, PETRreader, utilities
+import logging
+import sqlite3
+
+from petrarch import petrarch, PETRglobals, PETRreader, PETRcache, PETRmetrics, PETRstore, utilities
 
 
 config = petrarch.utilities._get_data('data/config/', 'PETR_config.ini')
@@ -178,11 +181,343 @@ def test_read_treebank():
     assert plist == list and pstart == 2
 
 
+def test_read_treebank_markup():
+    parse = ("(ROOT (S (NP (NP (NNP Israel) (POS 's)) (NN army)) (VP (VBD attacked) "
+             "(NP (NP (NNP Hamas) (CC and) (NNP Hezbollah)) (SBAR (WHNP (WDT which)) "
+             "(S (VP (VBD fired) (NP (NNS rockets))))))) (. .)))")
+    plist, pstart = petrarch.read_TreeBank(utilities._format_parsed_str(parse))
+    assert plist == ['(ROOT', '(S', '(NE', '---', 'ISRAEL', 'ARMY', '~NE', '(VP1', '(VBD',
+                     'ATTACKED', '~VBD', '(NP1', '(NEC1', '(NE', '---', 'HAMAS', '~NE',
+                     '(NE', '---', 'HEZBOLLAH', '~NE', '~NEC1', '(SBR', 'WHICH', 'FIRED',
+                     'ROCKETS', '~SBR', '~NP1', '~VP1', '(.', '.', '~.', '~S', '~ROOT']
+    assert pstart == 1
+
+
+def test_index_phrases():
+    plist = "(S (NE --- A ~NE (VP1 (VBD B ~VBD (NE --- C ~NE ~VP1 ~S".split()
+    pmatch = petrarch.index_phrases(plist)
+    assert [pmatch[ka] for ka in (0, 1, 5, 14)] == [14, 4, 13, 0]
+    assert pmatch[2] == pmatch[3] == -1
+    # a ~XX closes the nearest (XX even if the tags inside are unbalanced
+    assert petrarch.index_phrases("(NE --- (NP (NNP A ~NNP ~NE".split()) == \
+        [6, -1, -1, 5, -1, 3, 0]
+
+    petrarch.splice_phrases(plist, pmatch, 1, 5)
+    assert pmatch == petrarch.index_phrases(plist)
+    newlist = "(NEC (NE --- D ~NE (NE --- E ~NE ~NEC".split()
+    petrarch.splice_phrases(plist, pmatch, 5, 9, newlist)
+    assert plist[4:7] == ['~VBD', '(NEC', '(NE']
+    assert pmatch == petrarch.index_phrases(plist)
+
+
+def test_check_commas():
+    # the bundled config drops internal and terminal clauses of 2 to 8 words
+    parse = ("(ROOT (S (NP (NP (NNP Obama)) (, ,) (NP (DT the) (JJ American) (NN president)) "
+             "(, ,)) (VP (VBD visited) (NP (NNP France)) (, ,) (NP (DT the) (NN ally))) (. .)))")
+    plist, pstart = petrarch.read_TreeBank(utilities._format_parsed_str(parse))
+    pmatch = petrarch.index_phrases(plist)
+    assert petrarch.check_commas(plist, pmatch) == \
+        ['(ROOT', '(S', '(NP1', '(NE', '---', 'OBAMA', '~NE', '(,', ',', '~,', '~NP1',
+         '(VP1', '(VBD', 'VISITED', '~VBD', '(NE', '---', 'FRANCE', '~NE', '~VP1',
+         '(.', '.', '~.', '~S', '~ROOT']
+    assert pmatch == petrarch.index_phrases(plist)
+
+
+def test_assign_NEcodes():
+    parse = ("(ROOT (S (NP (NP (NNS Lawmakers)) (PP (IN in) (NP (NNP Fornost) (CC and) "
+             "(NNP Gondor)))) (VP (VBD welcomed) (NP (NNP Eriador))) (. .)))")
+    plist, pstart = petrarch.read_TreeBank(utilities._format_parsed_str(parse))
+    original = list(plist)
+    pmatch = petrarch.index_phrases(plist)
+    compounds = petrarch.assign_NEcodes(plist, pmatch, pstart, '20150101')
+    # the compound is expanded beside ParseList rather than in it
+    assert plist == original
+    assert sorted(compounds) == [2, 17] and compounds[2] is compounds[17]
+    assert compounds[2].items == ['(NEC', '(NE', '---LEG', '---', 'LAWMAKERS', 'FORNOST', '~NE',
+                                  '(NE', '---LEG', '---', 'LAWMAKERS', 'GONDOR', '~NE', '~NEC']
+    upper = petrarch.get_upper_seq(17, plist, pstart, compounds)
+    assert [str(item) for item in upper] == \
+        ['~NEC', '~NE', 'GONDOR', 'LAWMAKERS', '---', '(NE<9>---LEG', '~NE', 'FORNOST',
+         'LAWMAKERS', '---', '(NE<3>---LEG', '(NEC']
+    assert (upper[5].code, upper[5].start, upper[5].end) == ('---LEG', 2, 5)
+
+    lower = petrarch.get_lower_seq(22, '~VP1', plist, compounds)
+    assert [str(item) for item in lower] == ['(NE<22>---', 'ERIADOR', '~NE']
+    target = petrarch.find_target(lower, "")
+    source = petrarch.find_source(upper, lower, "", target)
+    assert (target, source) == ([0, False], [11, True])
+    PETRglobals.NewActorLength = 5
+    try:
+        assert petrarch.get_loccodes(source, [], upper, lower) == ['---LEG', '---LEG']
+        assert petrarch.get_loccodes(target, [], upper, lower) == ['"ERIADOR"']
+    finally:
+        PETRglobals.NewActorLength = 0
+
+
+def test_parse_cache(tmpdir):
+    path = str(tmpdir.join('parses.db'))
+    cache = PETRcache.ParseCache(path, 'test-1', size=1)
+    assert cache.get("Germany invaded France") is None
+    cache.put("Germany invaded France", {'parsetree': '(ROOT (S ))'})
+    cache.put("Germany arrested France", {'parsetree': '(ROOT (NP ))'})
+    # evicted from memory, but still on disk; whitespace is normalized
+    assert cache.get("Germany  invaded\nFrance") == {'parsetree': '(ROOT (S ))'}
+    cache.close()
+
+    assert PETRcache.ParseCache(path, 'test-1').get(
+        "Germany arrested France") == {'parsetree': '(ROOT (NP ))'}
+    assert PETRcache.ParseCache(path, 'test-2').get(
+        "Germany arrested France") is None
+
+    cache = PETRcache.ParseCache(path, 'test-1', size=0)
+    cache.put_many([("France invaded Germany", {'parsetree': '(ROOT (S1 ))'}),
+                    ("France arrested Germany", {'parsetree': '(ROOT (S2 ))'})])
+    assert cache.get_many(["France arrested Germany", "Germany invaded France",
+                           "Spain invaded France", "France arrested Germany"]) == \
+        [{'parsetree': '(ROOT (S2 ))'}, {'parsetree': '(ROOT (S ))'}, None,
+         {'parsetree': '(ROOT (S2 ))'}]
+
+    # a file locked by another process is a miss rather than a wait
+    busy = PETRcache.ParseCache(path, 'test-1', size=0, timeout=0)
+    locker = sqlite3.connect(path)
+    locker.execute('BEGIN EXCLUSIVE')
+    assert busy.get("Germany invaded France") is None
+    busy.put("Spain invaded France", {'parsetree': '(ROOT (S3 ))'})
+    locker.rollback()
+    assert busy.get_many(["Germany invaded France", "Spain invaded France"]) == \
+        [{'parsetree': '(ROOT (S ))'}, None]
+
+
+def test_coding_cache(tmpdir):
+    parse = utilities._format_parsed_str(
+        "(ROOT (S (NP (NNP Germany)) (VP (VBD invaded) (NP (NNP France)))))")
+    date = PETRreader.dstr_to_ordate('20010101')
+    first = petrarch.code_parse(parse, date)
+    first[0][0][2] = 'XXX'  # callers get copies of the cached events
+    assert petrarch.code_parse(parse, date) == [[['DEU', 'FRA', '192']], 0]
+
+    dictfile = tmpdir.join('test.txt')
+    dictfile.write("GERMANY [DEU]\n")
+    version = PETRreader.get_dictionary_version([str(dictfile)])
+    dictfile.write("GERMANY [DEU]\nFRANCE [FRA]\n")
+    assert PETRreader.get_dictionary_version([str(dictfile)]) != version
+
+
+def test_metrics():
+    events = PETRmetrics.Events.values.get(None, 0)
+    parse = "(ROOT (S (NP (NNP Germany)) (VP (VBD arrested) (NP (NNP France)))))"
+    dict = {u'test123': {u'sents': {u'0': {u'content': "Germany arrested France",
+                                           u'parsed': parse}},
+                         u'meta': {u'date': u'20010101'}}}
+    petrarch.do_coding(dict, None)
+    assert PETRmetrics.Events.values[None] == events + 1
 
-
-
-
-
-
-
-
+    hist = PETRmetrics.Histogram('test_seconds', 'Test.', 'stage', buckets=(0.1, 1))
+    try:
+        hist.observe(0.5, 'a')
+        hist.observe(0.1, 'a')
+        exposed = PETRmetrics.expose()
+        assert 'test_seconds_bucket{stage="a",le="0.1"} 1\n' in exposed
+        assert 'test_seconds_bucket{stage="a",le="+Inf"} 2\n' in exposed
+        assert 'test_seconds_count{stage="a"} 2\n' in exposed
+    finally:
+        # it would otherwise be exposed for the rest of the process
+        PETRmetrics.REGISTRY.remove(hist)
+    assert 'test_seconds' not in PETRmetrics.expose()
+
+
+def test_dictionary_snapshot(tmpdir):
+    path = str(tmpdir.join('dicts.snapshot'))
+    dictionaries = dict((name, getattr(PETRglobals, name))
+                        for name in PETRreader.SnapshotGlobals)
+    PETRreader.write_dictionary_snapshot(path, 'key-1', dictionaries)
+    assert PETRreader.read_dictionary_snapshot(path, 'key-2') is None
+    loaded = PETRreader.read_dictionary_snapshot(path, 'key-1')
+    assert loaded['ActorDict'] == PETRglobals.ActorDict
+    assert loaded['ActorDict'] is not PETRglobals.ActorDict
+    loaded = PETRreader.read_dictionary_snapshot(path, 'key-1', ('ActorDict',))
+    assert 'ActorDict' not in loaded
+    assert loaded['AgentDict'] == PETRglobals.AgentDict
+
+
+def test_dictionary_store(tmpdir):
+    path = str(tmpdir.join('dicts.store'))
+    PETRstore.write_store(path, 'key-1', {'ActorDict': PETRglobals.ActorDict,
+                                          'AgentDict': PETRglobals.AgentDict,
+                                          'ActorCodes': PETRglobals.ActorCodes})
+    store = PETRstore.MappedStore(path, 'key-1')
+    assert store.actors.trie("RUSSIA") == PETRglobals.ActorTries["RUSSIA"]
+    assert store.agents.trie("PRESIDENT") == PETRglobals.AgentTries["PRESIDENT"]
+    assert store.actors.trie("NOT_A_WORD") is None
+    index = PETRglobals.ActorDict["RUSSIA"][0][0]
+    assert store.actor_codes(index) == PETRglobals.ActorCodes[index]
+    assert store.date_cuts == PETRreader.get_actor_date_cuts()
+    # the dates of an actor are decoded once
+    assert store.actor_dates(index) is store.actor_dates(index)
+    for k in range(store.dates.maxsize + 1):
+        store.actor_dates(k)
+    assert len(store.dates) == store.dates.maxsize
+
+    PETRglobals.DictionaryStore = store
+    PETRglobals.CodingCache.clear()
+    try:
+        test_simple()
+    finally:
+        PETRglobals.DictionaryStore = None
+        store.close()
+
+
+def test_get_issues():
+    text = "The genocide and massacres were a war crime against humanity ."
+    assert petrarch.get_issues(text) == [['ID_ATROCITY', 3]]
+    text = ("At least 37 people are dead after Islamist radical group Boko "
+            "Haram assaulted a town in northeastern Nigeria .")
+    assert petrarch.get_issues(text) == [['ID_EXTREMISM', 1],
+                                         ['NAMED_TERROR_GROUP', 1]]
+    # an ignore phrase cancels the issues of the whole sentence
+    assert petrarch.get_issues("They got a head start on the genocide .") == []
+
+
+def test_check_discards():
+    assert petrarch.check_discards("Germany invaded France .") == [0, '']
+    # a match restarts on the word that broke off a partial one
+    text = "Shelling went on for years years later ."
+    assert petrarch.check_discards(text) == [1, '  YEARS LATER']
+    # story discards take priority over sentence discards seen earlier
+    text = "The bronze medal went to Manchester United ."
+    assert petrarch.check_discards(text) == [2, '+  MANCHESTER UNITED']
+    # a phrase at the very end of the sentence
+    assert petrarch.check_discards("He won the bronze medal") == \
+        [1, '  BRONZE MEDAL']
+
+
+def test_match_pattern_trie():
+    patlist = [['ABC', '_', ('', ' ')],
+               ['DEF', ' ', ('ARMY', '_'), ('CHIEF', '_'), ('', ' ')],
+               ['GHI', '_', ('ARMY', ' '), ('', ' ')]]
+    trie = PETRreader.make_pattern_trie(patlist[1:])
+    # ' ' allows words in between, '_' does not
+    assert petrarch.match_pattern_trie(trie, "KEY ARMY".split()) == ('GHI', 2)
+    assert petrarch.match_pattern_trie(trie, "KEY OLD ARMY CHIEF".split()) == \
+        ('DEF', 4)
+    assert petrarch.match_pattern_trie(trie, "KEY OLD ARMY".split()) is None
+    # the first pattern in the list wins, however long the others are
+    trie = PETRreader.make_pattern_trie(patlist)
+    assert petrarch.match_pattern_trie(trie, "KEY ARMY CHIEF".split()) == \
+        ('ABC', 1)
+
+    # (actor codes, agent code) of each phrase, or None if nothing matches
+    phrases = {"UNITED KINGDOM OF GREAT BRITAIN": ((['GBR'],), None),
+               "UNITED NATIONS ENVOY": ((['IGOUNO'],), None),
+               "UNITED STATES SECRETARY OF STATE": ((['USA'],), None),
+               "FOREIGN AFFAIRS MINISTRY": (None, '~GOV'),
+               "FOREIGN MINISTER": (([2, 130071, 141622, 'RUSGOV'],), '~GOV'),
+               "FOREIGN TROOPS": (None, None)}
+    for phrase, (actor, agent) in phrases.items():
+        words = phrase.split()
+        found = petrarch.match_pattern_trie(PETRglobals.ActorTries[words[0]],
+                                            words)
+        if actor is None:
+            assert found is None
+        else:
+            assert PETRglobals.ActorCodes[found[0]] == actor and found[1] == 2
+        found = None
+        if words[0] in PETRglobals.AgentTries:
+            found = petrarch.match_pattern_trie(
+                PETRglobals.AgentTries[words[0]], words)
+        assert found == (agent and (agent, 2))
+
+
+def test_get_actor_code():
+    index = PETRglobals.ActorDict["OBAMA"][0][0]
+    codelist = PETRglobals.ActorCodes[index]
+    cuts = sorted(PETRreader.get_restriction_cuts(codelist))
+    assert cuts
+    PETRglobals.ActorCodeMemo.clear()
+    for date in [cuts[0] - 1000] + cuts + [cut - 1 for cut in cuts]:
+        assert petrarch.get_actor_code(index, date) == \
+            PETRreader.resolve_actor_code(codelist, date)
+    assert PETRglobals.ActorCodeMemo[(index, cuts[0])] == \
+        PETRreader.resolve_actor_code(codelist, cuts[0])
+
+
+def test_read_dictionary_files():
+    saved = dict((name, getattr(PETRglobals, name))
+                 for name in PETRreader.SnapshotGlobals)
+    nactors = len(PETRglobals.ActorFileList)
+    actor_paths = petrarch.get_dictionary_paths()[1:1 + nactors]
+    try:
+        # each file is read on its own, as in a worker, and then re-based
+        partials = [('actor', PETRreader.read_dictionary_file(
+            ('actor', path, PETRglobals.WriteActorRoot))) for path in actor_paths]
+        assert all(partial['ActorCodes'] for kind, partial in partials)
+        merged = PETRreader.merge_dictionary_files(partials)
+        assert merged['ActorCodes'] == saved['ActorCodes']
+        assert merged['ActorCodeDates'] == saved['ActorCodeDates']
+        assert merged['ActorDict'] == saved['ActorDict']
+        # reading leaves the dictionaries in use alone
+        for name, value in saved.items():
+            assert getattr(PETRglobals, name) is value
+    finally:
+        for name, value in saved.items():
+            setattr(PETRglobals, name, value)
+
+
+def test_failed_reload(tmpdir):
+    path = tmpdir.join('broken.agents.txt')
+    agents = petrarch.get_dictionary_paths()[1 + len(PETRglobals.ActorFileList)]
+    path.write(open(agents, 'rb').read() + b"[~GOV]\n", 'wb')
+    names = ('AgentFileName', 'SnapshotFileName', 'StoreFileName')
+    config = dict((name, getattr(PETRglobals, name)) for name in names)
+    saved = dict((name, getattr(PETRglobals, name)) for name in
+                 PETRreader.SnapshotGlobals + ('DictionaryVersion', 'CodingCache'))
+    PETRglobals.AgentFileName = str(path)
+    PETRglobals.SnapshotFileName = ""
+    PETRglobals.StoreFileName = ""
+    try:
+        try:
+            petrarch.read_dictionaries(processes=1)
+        except IndexError:
+            pass
+        else:
+            assert False, "the broken agent dictionary was read"
+    finally:
+        for name, value in config.items():
+            setattr(PETRglobals, name, value)
+    # the dictionaries in use are all kept
+    for name, value in saved.items():
+        assert getattr(PETRglobals, name) is value
+    test_simple()
+
+
+def test_read_dictionary_lines(tmpdir):
+    path = tmpdir.join('dict.txt')
+    path.write("# comment\nALPHA [A]\n\n<!-- note -->\nBETA # B\n"
+               "GAMMA <!-- old --> [C]\nDELTA <!-- start\nmore -->\nEPSILON")
+    lines = PETRreader.read_dictionary_lines(str(path), "test")
+    other = PETRreader.read_dictionary_lines(str(path), "test")
+    assert PETRreader.next_line(other) == "ALPHA [A]\n"
+    # a multi-line comment takes the rest of its first line with it
+    assert list(lines) == [(2, "ALPHA [A]\n"), (5, "BETA "),
+                           (6, "GAMMA  [C]\n"), (9, "EPSILON")]
+    assert PETRreader.next_line(lines) == ''
+    assert PETRreader.next_line(other) == "BETA "
+    assert other.where() == " (dict.txt line 5)"
+
+
+def test_dictionary_warning_line(tmpdir):
+    path = tmpdir.join('test.agents.txt')
+    path.write("PRESIDENT [~GOV]\nMINISTER\n")
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    logger = logging.getLogger('petr_log')
+    logger.addHandler(handler)
+    try:
+        agents = PETRreader.read_dictionary_file(('agent', str(path), False))
+    finally:
+        logger.removeHandler(handler)
+    assert "PRESIDENT" in agents['AgentDict']
+    assert [message for message in messages if 'Codes are required' in message] \
+        == ["Codes are required for agents in .agents file ; line skipped"
+            " (test.agents.txt line 2)"]
@@ -39,6 +39,7 @@ import logging
 import corenlp
 import dateutil.parser
 import PETRglobals
+import PETRcache
 from collections import defaultdict, Counter
 
 
@@ -48,17 +49,12 @@ from collections import defaultdict, Counter
 def stanford_parse(event_dict):
     logger = logging.getLogger('petr_log')
     # What is dead can never die...
-    print("\nSetting up StanfordNLP. The program isn't dead. Promise.")
-    logger.info('Setting up StanfordNLP')
-    core = corenlp.StanfordCoreNLP(PETRglobals.stanfordnlp,
-                                   properties=_get_data('data/config/',
-                                                        'petrarch.properties'),
-                                   memory='2g')
+    cache = PETRcache.ParseCache(PETRglobals.ParseCacheFile,
+                                 PETRglobals.ParserVersion)
+    core = None
     total = len(list(event_dict.keys()))
-    print(
-        "Stanford setup complete. Starting parse of {} stories...".format(total))
-    logger.info(
-        'Stanford setup complete. Starting parse of {} stories.'.format(total))
+    print("Starting parse of {} stories...".format(total))
+    logger.info('Starting parse of {} stories.'.format(total))
     for i, key in enumerate(event_dict.keys()):
         if (i / float(total)) * 100 in [10.0, 25.0, 50, 75.0]:
             print('Parse is {}% complete...'.format((i / float(total)) * 100))
@@ -73,10 +69,26 @@ def stanford_parse(event_dict):
                 pass
             else:
                 try:
-                    stanford_result = core.raw_parse(sent_dict['content'])
-                    s_parsetree = stanford_result['sentences'][0]['parsetree']
-                    if 'coref' in stanford_result:
-                        sent_dict['coref'] = stanford_result['coref']
+                    cached = cache.get(sent_dict['content'])
+                    if cached is None:
+                        if core is None:
+                            # only start CoreNLP once a sentence misses the cache
+                            print("\nSetting up StanfordNLP. The program isn't dead. Promise.")
+                            logger.info('Setting up StanfordNLP')
+                            core = corenlp.StanfordCoreNLP(
+                                PETRglobals.stanfordnlp,
+                                properties=_get_data('data/config/',
+                                                     'petrarch.properties'),
+                                memory='2g')
+                            logger.info('Stanford setup complete.')
+                        stanford_result = core.raw_parse(sent_dict['content'])
+                        cached = {'parsetree': stanford_result['sentences'][0]['parsetree']}
+                        if 'coref' in stanford_result:
+                            cached['coref'] = stanford_result['coref']
+                        cache.put(sent_dict['content'], cached)
+                    s_parsetree = cached['parsetree']
+                    if 'coref' in cached:
+                        sent_dict['coref'] = cached['coref']
 
                     # TODO: To go backwards you'd do str.replace(' ) ', ')')
                     sent_dict['parsed'] = _format_parsed_str(s_parsetree)
@@ -84,6 +96,7 @@ def stanford_parse(event_dict):
                     print('Something went wrong. ¯\_(ツ)_/¯. See log file.')
                     logger.warning(
                         'Error on {}_{}. ¯\_(ツ)_/¯. {}'.format(key, sent, e))
+    cache.close()
     print('Done with StanfordNLP parse...\n\n')
     logger.info('Done with StanfordNLP parse.')
 
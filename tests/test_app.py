@@ -0,0 +1,247 @@
+import json
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+import app
+from petrarch import petrarch
+
+
+print("reading config")
+app.read_config()
+print("reading dicts")
+petrarch.read_dictionaries()
+
+PARSED_DOCUMENT = {
+    'id': 'test123', 'date': '20010101',
+    'sents': [{'content': "Germany invaded France",
+               'parsed': "(ROOT (S (NP (NNP Germany)) (VP (VBD invaded) "
+                         "(NP (NNP France)))))"}]}
+
+
+def ccnlp_output(*sentences):
+    return {'sentences': [{'tokens': tokens.split(), 'parse': '(ROOT)'}
+                          for tokens in sentences]}
+
+
+def fake_ccnlp(text):
+    """ Splits text into sentences at each period, as CoreNLP does. """
+    sentences = [[]]
+    for token in text.split():
+        sentences[-1].append(token)
+        if token == '.':
+            sentences.append([])
+    return ccnlp_output(*[' '.join(tokens) for tokens in sentences if tokens])
+
+
+def patch_ccnlp(monkeypatch):
+    """ Replaces send_to_ccnlp() with fake_ccnlp(); returns the texts it gets. """
+    calls = []
+
+    @gen.coroutine
+    def send_to_ccnlp(text, deadline=None):
+        calls.append(text)
+        raise gen.Return(fake_ccnlp(text))
+    monkeypatch.setattr(app, 'send_to_ccnlp', send_to_ccnlp)
+    return calls
+
+
+######################################
+#
+#       Parse batching tests
+#
+######################################
+
+def test_split_ccnlp_output():
+    output = ccnlp_output("Germany arrested France .",
+                          "HYPNOSBATCHBREAK .",
+                          "Russia met Ukraine .", "They talked .",
+                          "HYPNOSBATCHBREAK .",
+                          "Israel left .")
+    assert app.split_ccnlp_output(output, 3) == [
+        ccnlp_output("Germany arrested France ."),
+        ccnlp_output("Russia met Ukraine .", "They talked ."),
+        ccnlp_output("Israel left .")]
+
+
+def test_split_ccnlp_output_merged_break():
+    # a text without final punctuation pulls the marker into its last sentence
+    output = ccnlp_output("Germany arrested France HYPNOSBATCHBREAK .",
+                          "Russia met Ukraine .")
+    assert app.split_ccnlp_output(output, 2) is None
+    output = ccnlp_output("Germany arrested France .",
+                          "HYPNOSBATCHBREAK Russia met Ukraine .")
+    assert app.split_ccnlp_output(output, 2) is None
+
+
+def test_split_ccnlp_output_count():
+    output = ccnlp_output("Germany arrested France .", "HYPNOSBATCHBREAK .",
+                          "Russia met Ukraine .")
+    assert app.split_ccnlp_output(output, 3) is None
+    assert app.split_ccnlp_output(output, 1) is None
+
+
+def test_send_batch_to_ccnlp(monkeypatch):
+    calls = patch_ccnlp(monkeypatch)
+    texts = ["Germany arrested France .", "Russia met Ukraine ."]
+    outputs = IOLoop.current().run_sync(
+        lambda: app.send_batch_to_ccnlp(texts), timeout=5)
+    assert outputs == [fake_ccnlp(text) for text in texts]
+    assert len(calls) == 1
+
+
+def test_send_batch_to_ccnlp_fallback(monkeypatch):
+    calls = patch_ccnlp(monkeypatch)
+    texts = ["Germany arrested France", "Russia met Ukraine ."]
+    outputs = IOLoop.current().run_sync(
+        lambda: app.send_batch_to_ccnlp(texts), timeout=5)
+    assert outputs == [fake_ccnlp(text) for text in texts]
+    # the combined call, then one for each text
+    assert calls[1:] == texts
+
+
+def test_parse_batcher_duplicates(monkeypatch):
+    calls = patch_ccnlp(monkeypatch)
+    batcher = app.ParseBatcher(0.001, 10)
+    texts = ["Germany arrested France .", "Russia met Ukraine .",
+             "Germany arrested France ."]
+
+    @gen.coroutine
+    def parse():
+        outputs = yield [batcher.parse(text) for text in texts]
+        raise gen.Return(outputs)
+    outputs = IOLoop.current().run_sync(parse, timeout=5)
+    assert outputs == [fake_ccnlp(text) for text in texts]
+    # the repeated text is sent once, together with the other one
+    assert calls == [" HYPNOSBATCHBREAK . ".join(texts[:2])]
+
+
+def test_parse_batcher_size(monkeypatch):
+    calls = patch_ccnlp(monkeypatch)
+    batcher = app.ParseBatcher(60, 2)
+    texts = ["Germany arrested France .", "Russia met Ukraine .",
+             "Israel left ."]
+
+    @gen.coroutine
+    def parse():
+        futures = [batcher.parse(text) for text in texts]
+        # the first two went out as soon as they were pending
+        assert len(calls) == 1
+        batcher.flush()
+        outputs = yield futures
+        raise gen.Return(outputs)
+    outputs = IOLoop.current().run_sync(parse, timeout=5)
+    assert outputs == [fake_ccnlp(text) for text in texts]
+    assert calls[1] == texts[2]
+
+
+######################################
+#
+#       Handler tests
+#
+######################################
+
+class HandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        application = app.make_app()
+        # one request at a time, and one more waiting for it
+        app.admission = app.Admission(1, 1)
+        return application
+
+    def extract(self, doc, **kwargs):
+        return self.fetch('/hypnos/extract', method='GET', body=json.dumps(doc),
+                          allow_nonstandard_methods=True, **kwargs)
+
+    def post(self, path, body, **kwargs):
+        return self.fetch(path, method='POST', body=json.dumps(body), **kwargs)
+
+    def start_code(self, **kwargs):
+        """ Returns a Future for the response to a /hypnos/code request. """
+        return self.http_client.fetch(self.get_url('/hypnos/code'), method='POST',
+                                      body=json.dumps(PARSED_DOCUMENT),
+                                      raise_error=False, **kwargs)
+
+    def assert_error(self, response, code, error):
+        self.assertEqual(response.code, code)
+        self.assertEqual(json.loads(response.body), {'error': error})
+
+    def test_code(self):
+        response = self.post('/hypnos/code', PARSED_DOCUMENT)
+        self.assertEqual(response.code, 200)
+        story = json.loads(response.body)['test123']
+        self.assertEqual(story['sents']['0']['events'], [['DEU', 'FRA', '192']])
+
+    def test_bad_documents(self):
+        doc = {'text': "Germany invaded France", 'id': 'test123',
+               'date': '20010101'}
+        for field, value in [('text', None), ('text', 5), ('id', ''),
+                             ('date', None), ('date', 20010101),
+                             ('date', '2001-01-01'), ('date', '20011301')]:
+            response = self.extract(dict(doc, **{field: value}))
+            self.assert_error(response, 400, 'Bad request')
+        self.assert_error(self.extract([doc]), 400, 'Bad request')
+        response = self.fetch('/hypnos/extract', method='GET', body='{"text":',
+                              allow_nonstandard_methods=True)
+        self.assert_error(response, 400, 'Bad request')
+
+    def test_bad_parsed_documents(self):
+        sent = PARSED_DOCUMENT['sents'][0]
+        for doc in [dict(PARSED_DOCUMENT, date='20011301'),
+                    dict(PARSED_DOCUMENT, sents=sent),
+                    dict(PARSED_DOCUMENT, sents=[dict(sent, parsed=None)]),
+                    dict(PARSED_DOCUMENT, sents=[dict(sent, parsed=['(ROOT)'])]),
+                    dict(PARSED_DOCUMENT, sents=[dict(sent, content=5)])]:
+            response = self.post('/hypnos/code', doc)
+            self.assert_error(response, 400, 'Bad request')
+
+    def test_duplicate_ids(self):
+        doc = {'text': "Germany invaded France", 'id': 'test123',
+               'date': '20010101'}
+        response = self.post('/hypnos/extract/batch', [doc, dict(doc)])
+        self.assert_error(response, 400, 'Bad request')
+        response = self.post('/hypnos/code', [PARSED_DOCUMENT, PARSED_DOCUMENT])
+        self.assert_error(response, 400, 'Bad request')
+
+    def test_bad_request_timeout(self):
+        response = self.post('/hypnos/code', PARSED_DOCUMENT,
+                             headers={'X-Request-Timeout': 'soon'})
+        self.assert_error(response, 400, 'Bad request')
+
+    @gen_test
+    def test_concurrency_limit(self):
+        yield app.admission.acquire(self.io_loop.time() + 5)
+        response = self.start_code()
+        yield gen.sleep(0.1)
+        # the request waits for the slot that is taken
+        self.assertFalse(response.done())
+        self.assertEqual(app.admission.queued, 1)
+        app.admission.release()
+        response = yield response
+        self.assertEqual(response.code, 200)
+        self.assertEqual((app.admission.active, app.admission.queued), (0, 0))
+
+    @gen_test
+    def test_queue_limit(self):
+        yield app.admission.acquire(self.io_loop.time() + 5)
+        waiting = self.start_code()
+        yield gen.sleep(0.1)
+        # the queue is full, so this one is turned away without waiting
+        start = self.io_loop.time()
+        response = yield self.start_code()
+        self.assertLess(self.io_loop.time() - start, 1)
+        self.assert_error(response, 503, 'Queue full')
+        self.assertEqual(response.headers['Retry-After'], '5')
+        app.admission.release()
+        response = yield waiting
+        self.assertEqual(response.code, 200)
+
+    @gen_test
+    def test_request_timeout(self):
+        yield app.admission.acquire(self.io_loop.time() + 5)
+        response = yield self.start_code(headers={'X-Request-Timeout': '0.1'})
+        self.assert_error(response, 503, 'Deadline exceeded')
+        self.assertEqual(response.headers['Retry-After'], '5')
+        # it gave up its place in the queue
+        self.assertEqual((app.admission.active, app.admission.queued), (1, 0))
+        app.admission.release()
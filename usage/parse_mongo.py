@@ -1,4 +1,5 @@
 import json
+import logging
 import requests
 from pymongo import MongoClient
 
@@ -14,20 +15,61 @@ junk = []
 # figure out /process and /code
 
 headers = {'Content-Type': 'application/json'}
+batch_size = 50
 
+logging.basicConfig()
+logger = logging.getLogger('parse_mongo')
+
+
+def is_valid(doc):
+    # the API turns down the whole batch for one document it cannot code
+    return (isinstance(doc['text'], basestring) and doc['text'].strip() and
+            doc['id'])
+
+
+def post_batch(batch):
+    data = json.dumps(batch)
+    r = requests.post('http://localhost:5002/hypnos/extract/batch', data=data,
+                      headers=headers)
+    try:
+        rj = r.json()
+    except ValueError:
+        return {'error': r.text}
+    # errors come back as {"error": ...}, but a story id could be "error" too
+    if r.status_code != 200:
+        return rj
+    output.extend({key: story} for key, story in rj.iteritems())
+
+
+def send_batch(batch):
+    error = post_batch(batch)
+    if error is None:
+        return
+    logger.warning('Batch of %d documents failed: %s', len(batch), error)
+    if len(batch) == 1:
+        junk.append((batch[0]['id'], error))
+        return
+    # find the documents that cause it
+    for doc in batch:
+        send_batch([doc])
+
+
+batch = []
 for i in t:
-    data = {'text': i['article_body'], 'id': i['doc_id'], 'date': '20010101'}
-    data = json.dumps(data)
-    r = requests.get('http://localhost:5002/hypnos/extract', data=data,
-                     headers=headers)
-    rj = r.json()
-    if 'status' in rj:
-        junk.append(rj)
-    else:
-        output.append(rj)
+    doc = {'text': i['article_body'], 'id': i['doc_id'], 'date': '20010101'}
+    if not is_valid(doc):
+        logger.warning('Skipping document %s: no id or text', doc['id'])
+        junk.append((doc['id'], 'no id or text'))
+        continue
+    batch.append(doc)
+    if len(batch) == batch_size:
+        send_batch(batch)
+        batch = []
+if batch:
+    send_batch(batch)
 
 
 for o in output:
     for key, s in o[o.keys()[0]]['sents'].iteritems():
-        if s['events']:
+        if s.get('events'):
             print s['events']